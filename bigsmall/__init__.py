@@ -0,0 +1,14 @@
+'''bigSMALL: BacterIal Genome-Scale Metabolic models for AppLied reverse ecoLogy
+
+Load the KEGG reference once and score any number of expression profiles in-process:
+
+	reference = bigsmall.load_reference()
+	result = bigsmall.run_sample('ko_expression.tsv', reference, iterations=1000)
+'''
+
+from .reference import default_reference, load_reference, compound_names, reference_version
+from .network import open_expression, transcription_dictionary, expression_matrix, Graph, network_graph, network_dictionaries, incidence_matrices
+from .scoring import importance_scores, transcription_scores, block_seeds, permutation_block, NullDistribution, empirical_pvalues, benjamini_hochberg, probability_distribution, confidence_interval
+from .cache import Cache, graph_key, cached_graph
+from .model import Model, Sample, SampleResult, run_sample, run_batch
+from .community import ScoreMatrix, pair_interactions, unordered_pair_interactions, community_totals, extreme_interactions, percentile_bins, permuted_scores, PairSignificance, crosstalk_null, Community
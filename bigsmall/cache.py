@@ -0,0 +1,141 @@
+'''On-disk cache of results that are expensive to rebuild, shared by every run pointed at the same directory'''
+
+import os
+import hashlib
+import tempfile
+import numpy
+
+from .reference import reference_version
+from .network import Graph, network_graph
+
+#---------------------------------------------------------------------------------------#		
+
+class Cache(object):
+	'''Directory of .npz entries, evicted least recently used first once they exceed a size budget
+
+	Each entry is one uncompressed .npz file named by its kind and key. Reading an entry updates its 
+	modification time, which is what eviction orders by, so it does not rely on access times.
+	'''
+
+	def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.versions = []  # (reference, version) pairs already hashed by this cache
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+	def path(self, kind, key):
+
+		return os.path.join(self.directory, kind + '.' + key + '.npz')
+
+	# Arrays stored under a key, or None if there is no entry
+	def load(self, kind, key):
+
+		entry_path = self.path(kind, key)
+		try:
+			with numpy.load(entry_path, allow_pickle=False) as entry:
+				arrays = dict((name, entry[name]) for name in entry.files)
+		except (IOError, OSError, ValueError):
+			return None
+		# Another run sharing the cache may evict the entry once it is read, which does not make the read invalid
+		try:
+			os.utime(entry_path, None)
+		except OSError:
+			pass
+
+		return arrays
+
+	# Store arrays under a key, written to a temporary file first so concurrent readers never see a partial entry
+	def save(self, kind, key, arrays):
+
+		handle, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+		with os.fdopen(handle, 'wb') as entry:
+			numpy.savez(entry, **arrays)
+		# Temporary files are private to their creator, entries are readable by everyone sharing the cache
+		os.chmod(temporary_path, 0o644)
+		os.replace(temporary_path, self.path(kind, key))
+		self.evict()
+
+	# Remove the least recently used entries until the cache fits in its budget
+	def evict(self):
+
+		entries = []
+		for entry_file in os.listdir(self.directory):
+			if not entry_file.endswith('.npz'): continue
+			entry_path = os.path.join(self.directory, entry_file)
+			try:
+				status = os.stat(entry_path)
+			except OSError:
+				continue
+			entries.append((status.st_mtime, status.st_size, entry_path))
+
+		total = sum([x[1] for x in entries])
+		for modified, size, entry_path in sorted(entries):
+			if total <= self.max_bytes: break
+			try:
+				os.remove(entry_path)
+			except OSError:
+				pass
+			total -= size
+
+	# Version hash of a reference store, computed once per reference object
+	def version(self, reference):
+
+		for cached_reference, version in self.versions:
+			if cached_reference is reference: return version
+		version = reference_version(reference)
+		self.versions.append((reference, version))
+
+		return version
+
+
+# Key for the graph of a KO set, independent of the order KOs are listed in
+def graph_key(KOs, version):
+
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update(version.encode('utf-8'))
+	digest.update('\n'.join(sorted(set(KOs))).encode('utf-8'))
+
+	return digest.hexdigest()
+
+
+# Build the graph for a KO set, or load it if the same KO set was already translated against the same reference
+def cached_graph(cache, KOs, reference):
+
+	key = graph_key(KOs, cache.version(reference))
+	entry = cache.load('graph', key)
+	if entry is not None:
+		print('Loaded bipartite graph from cache.\n')
+		graph = Graph(entry['ko_ids'], entry['compound_ids'], [str(x) for x in entry['query_kos']], entry['input_ko'], entry['input_compound'], entry['output_ko'], entry['output_compound'])
+		return graph, str(entry['key_errors'])
+
+	graph, key_errors = network_graph(KOs, reference)
+	arrays = dict((name, getattr(graph, name)) for name in ['ko_ids', 'compound_ids', 'input_ko', 'input_compound', 'output_ko', 'output_compound'])
+	arrays['query_kos'] = numpy.array(graph.query_kos, dtype=str)
+	arrays['key_errors'] = numpy.array(key_errors)
+	cache.save('graph', key, arrays)
+
+	return graph, key_errors
+
+
+# Key for the permuted scores of a graph, depending only on the incidence matrices, the sorted transcript multiset 
+#	and the permutation settings, plus the observed scores when they decide where adaptive runs stop
+def null_key(incidence, transcript_array, iterations, seed, unique, resolution, adaptive, observed=None):
+
+	if not isinstance(seed, numpy.random.SeedSequence):
+		seed = numpy.random.SeedSequence(seed)
+
+	digest = hashlib.blake2b(digest_size=16)
+	digest.update('\n'.join(incidence[0]).encode('utf-8'))
+	for matrix in incidence[1:]:
+		for array in [matrix.indptr, matrix.indices, matrix.data]:
+			digest.update(numpy.ascontiguousarray(array).tobytes())
+	digest.update(numpy.sort(numpy.asarray(transcript_array, dtype=float)).tobytes())
+	# Adaptive runs are keyed by their stopping rule too, so nulls from an earlier rule are not reused
+	rule = ('exceedances', adaptive) if adaptive > 0 else adaptive
+	digest.update(str([iterations, seed.entropy, seed.spawn_key, unique, resolution, rule]).encode('utf-8'))
+	if observed is not None:
+		digest.update(numpy.asarray(observed, dtype=float).tobytes())
+
+	return digest.hexdigest()
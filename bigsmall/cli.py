@@ -0,0 +1,340 @@
+'''Command line interface for bigSMALL, run through bigsmall.py or python -m bigsmall'''
+
+import sys
+import os
+import argparse
+import time
+import datetime
+
+from .reference import default_reference, load_reference
+from .network import open_expression, transcription_dictionary, expression_matrix
+from .model import Model
+from .cache import Cache
+from .output import write_list, write_list_short, write_dictionary, write_dictionary_short, write_dictionary_list, write_rows, OutputDirectory, RunArchive
+
+#---------------------------------------------------------------------------------------#		
+
+# Citation text
+citation = '''\nbigSMALL v1.4
+Released: 12/1/2016
+Updated: 5/17/2017
+
+by
+Matthew L. Jenior
+
+Department of Microbiology & Immunology
+University of Michigan
+mljenior@umich.edu
+
+When using, please cite:
+Jenior ML, Leslie JL, Young VB, & Schloss PD. (2017). Clostridium difficile colonizes alternative 
+	nutrient niches during infection across distinct murine gut microbiomes. mSystems. 2 (4); e00063-17.
+
+Distributed under the GNU General Public License\n\n'''
+
+#---------------------------------------------------------------------------------------#		
+
+# Write rows as a tab-delimited member or a typed .npy table member of the run output
+def write_output_rows(output, header, out_lst, member, output_format):
+
+	with output.open(member + '.' + output_format, output_format == 'npy') as out_file:
+		write_rows(header, out_lst, out_file, output_format)
+
+
+# Write importance scores for one sample, with significance and intervals when permutations were performed
+def write_importances(output, result, iterations, importance_file, interval_file, output_format='tsv'):
+
+	if iterations >= 1:
+		print('Writing importance scores and significance to output file...\n')
+		write_output_rows(output, ['Compound_code', 'Metabolite_name', 'Importance_score', 'p_value', 'q_value'], result.final_data, importance_file, output_format)
+		if output_format == 'tsv':
+			with output.open(interval_file + '.tsv') as out_file:
+				write_list('Compound_code\tLower_99_CI\tLower_95_CI\tSim_Mean\tUpper_95_CI\tUpper_99_CI\n', result.interval_lst, out_file)
+		else:
+			write_output_rows(output, ['Compound_code', 'Lower_CI', 'Sim_Median', 'Upper_CI'], result.interval_lst, interval_file, output_format)
+		print('Done.\n')
+
+	# If simulation not performed, write only scores calculated from measured expression to files	
+	else:
+		print('Writing importance scores to output file...\n')
+		score_lst = [[x, result.score_dict[x][0], round(result.score_dict[x][1], 3)] for x in sorted(result.score_dict.keys())]
+		write_output_rows(output, ['Compound_code', 'Metabolite_name', 'Importance_score'], score_lst, importance_file, output_format)
+		print('Done.\n')
+
+
+# Write importance scores for all samples of a batch as one table with a column per sample
+def write_wide_importances(output, samples, results, iterations, output_format='tsv'):
+
+	print('Writing importance scores for all samples to output file...\n')
+	compound_lst = sorted(results[0].score_dict.keys())
+
+	header = ['Compound_code', 'Metabolite_name']
+	for sample in samples:
+		header.append(sample + '_Importance_score')
+		if iterations >= 1: header += [sample + '_p_value', sample + '_q_value']
+
+	# Empirical p-values and q-values for each sample, looked up by compound
+	significance = [dict((x[0], x[3:5]) for x in result.final_data) if iterations >= 1 else {} for result in results]
+	out_lst = []
+	for compound in compound_lst:
+		entry = [compound, results[0].score_dict[compound][0]]
+		for index, result in enumerate(results):
+			entry.append(round(result.score_dict[compound][1], 3))
+			if iterations >= 1: entry += significance[index][compound]
+		out_lst.append(entry)
+
+	write_output_rows(output, header, out_lst, 'importances', output_format)
+	print('Done.\n')
+
+
+def main(argv=None):
+
+	# Start timer
+	start = time.time()
+
+	#-----------------------------------------------------------------------------------#		
+
+	# User defined arguments
+	parser = argparse.ArgumentParser(description='Generate bipartite metabolic models and calculates importance of substrate nodes based on gene expression.')
+	parser.add_argument('input_file')
+	parser.add_argument('--name', default='default', help='Organism or other name for KO+expression file (default is organism)')
+	parser.add_argument('--iters', default='1000', help='Number of iterations of probability distribution for score comparison')
+	parser.add_argument('--seed', default='none', help='Seed for the random number generator used to permute transcript distributions (default is unseeded)')
+	parser.add_argument('--unique', default='n', help='Discard repeated permutations of the transcript distribution (y or n)')
+	parser.add_argument('--workers', default='1', help='Number of processes used to score permutations, results for a given seed do not depend on it')
+	parser.add_argument('--resolution', default='none', help='Keep permuted scores as a histogram with this bin width so memory does not grow with --iters, intervals are then within half a bin width (default keeps every score)')
+	parser.add_argument('--adaptive', default='0', help='Stop permuting each compound once this many of its permuted scores are as extreme as its observed score, checked every 100 permutations with --iters as the maximum (default is 0, always run --iters)')
+	parser.add_argument('--cache', default='none', help='Directory for cached graphs, so a KO set already translated against the same reference is loaded rather than rebuilt (default is no cache)')
+	parser.add_argument('--cache_size', default='512', help='Size budget of the cache directory in megabytes, least recently used entries are removed beyond it')
+	parser.add_argument('--output-format', default='tsv', help='Write importances, confidence intervals, topology and the graph as tab-delimited text or as typed numpy tables that load without parsing (tsv or npy)')
+	parser.add_argument('--archive', default='n', help='Write every output of the run into one uncompressed <name>.bigsmall.zip with a manifest.json index, instead of a directory of files (y or n)')
+	parser.add_argument('--batch', default='n', help='Input is a KO-by-sample matrix with a header row of sample names, scored against one shared graph and written per sample or as one wide table (n, samples, or wide)')
+	args = parser.parse_args(argv)
+
+	# Assign variables
+	KO_input_file = str(args.input_file)
+	file_name = str(args.name)
+	iterations = int(args.iters)
+	seed = args.seed
+	unique = args.unique
+	workers = int(args.workers)
+	resolution = args.resolution
+	adaptive = int(args.adaptive)
+	batch = args.batch
+	cache = args.cache
+	output_format = args.output_format
+	archive = args.archive
+	cache_size = float(args.cache_size)
+
+	#-----------------------------------------------------------------------------------#			
+
+	# Check for input errors
+	if KO_input_file == 'input_file':
+		print('No KO+expression file provided. Aborting.')
+		sys.exit()
+	elif os.stat(KO_input_file).st_size == 0:
+		print('Empty input file provided. Aborting.')
+		sys.exit()
+	elif file_name == '':
+		print('Invalid names argument provided. Aborting.')
+		sys.exit()
+	elif iterations < 0:
+		print('Invalid iterations value. Aborting.')
+		sys.exit()
+	elif unique != 'y' and unique != 'n':
+		print('Invalid unique permutations response. Aborting.')
+		sys.exit()
+	elif workers < 1:
+		print('Invalid workers value. Aborting.')
+		sys.exit()
+	elif adaptive < 0:
+		print('Invalid adaptive value. Aborting.')
+		sys.exit()
+	elif not batch in ['n', 'samples', 'wide']:
+		print('Invalid batch response. Aborting.')
+		sys.exit()
+	elif not output_format in ['tsv', 'npy']:
+		print('Invalid output format. Aborting.')
+		sys.exit()
+	elif archive != 'y' and archive != 'n':
+		print('Invalid archive response. Aborting.')
+		sys.exit()
+	elif cache_size <= 0.0:
+		print('Invalid cache size. Aborting.')
+		sys.exit()
+
+	# Leave the random number generator unseeded unless a seed is given
+	if seed == 'none':
+		seed = None
+	else:
+		seed = int(seed)
+
+	# Keep every permuted score unless a histogram bin width is given
+	if resolution == 'none':
+		resolution = None
+	else:
+		resolution = float(resolution)
+		if resolution <= 0.0:
+			print('Invalid resolution value. Aborting.')
+			sys.exit()
+
+	# Keep graphs in the cache directory if one is given
+	if cache == 'none':
+		cache = None
+	else:
+		cache = Cache(os.path.abspath(cache), int(cache_size * 1024 * 1024))
+
+	# Make sure no spaces are in the name argument
+	file_name = file_name.replace(' ', '_')
+
+	#-----------------------------------------------------------------------------------#		
+
+	print(citation)
+
+	# Print organism name to screen to track progress in case of loop
+	if file_name != 'default':
+		print('\nImputing metabolism for ' + file_name + '\n')
+	else:
+		current_time = datetime.datetime.now().time()
+		current_time = current_time.strftime('%s/%d/%m/%Y')
+		current_time = current_time.replace('/','_')
+		current_time = current_time.replace('-','')
+		file_name = current_time
+
+	# Read in and create dictionary for expression, or a KO-by-sample matrix in batch mode, gzip-compressed files are read directly
+	with open_expression(KO_input_file) as KO_file:
+		if batch == 'n':
+			transcript_dict, total, seq_max = transcription_dictionary(KO_file)
+			all_KO_lst = list(transcript_dict.keys())
+		else:
+			all_KO_lst, samples, sample_matrix = expression_matrix(KO_file)
+
+	#-----------------------------------------------------------------------------------#		
+
+	# Outputs go to a new directory, or to a single archive file in archive mode
+	if archive == 'y':
+		output = RunArchive(os.path.join(os.getcwd(), file_name + '.bigsmall.zip'))
+	else:
+		output = OutputDirectory(os.path.join(os.getcwd(), file_name + '.bipartite.files'))
+
+	#-----------------------------------------------------------------------------------#		
+
+	# Read in the pre-parsed KO, reaction and compound reference store
+	print('\nReading in KEGG dictionaries...\n')
+	if not os.path.exists(default_reference):
+		print('KEGG reference store not found. Run support/create_network_refs.py first. Aborting.')
+		sys.exit()
+	kegg_reference = load_reference(default_reference)
+	print('Done.\n')
+
+	#-----------------------------------------------------------------------------------#	
+
+	# Translate KOs to the bipartite graph
+	model = Model(all_KO_lst, kegg_reference, cache)
+	with output.open('key_error.log') as errorfile:
+		errorfile.write(model.key_errors)
+
+	# Write compounds and enzymes to files
+	with output.open('metabolite.lst') as out_file:
+		write_list_short('none', model.compound_lst, out_file)
+	with output.open('enzyme.lst') as out_file:
+		write_list_short('none', model.KO_lst, out_file)
+
+	# Write network to a two column matrix for use in Neo4j or R
+	if output_format == 'tsv':
+		with output.open('graph.tsv') as out_file:
+			write_list('none', model.network_list, out_file)
+	else:
+		write_output_rows(output, ['Source', 'Target'], model.network_list, 'graph', output_format)
+
+	#-----------------------------------------------------------------------------------#	
+
+	# Calculate actual importance scores for each compound in the network, and simulated importance values if specified
+	print('Calculating metabolite connectedness and importance scores...\n')
+	if batch == 'n':
+		results = [model.run(transcript_dict, iterations, seed, unique == 'y', workers, resolution, adaptive)]
+	else:
+		results = model.run_batch(all_KO_lst, sample_matrix, iterations, seed, unique == 'y', workers, resolution, adaptive)
+	print('Done.\n')
+
+	if batch == 'n':
+		write_importances(output, results[0], iterations, 'importances', 'confidence_intervals', output_format)
+	elif batch == 'samples':
+		for sample, result in zip(samples, results):
+			write_importances(output, result, iterations, sample + '.importances', sample + '.confidence_intervals', output_format)
+	else:
+		write_wide_importances(output, samples, results, iterations, output_format)
+
+	print('Writing network topology and transcipt counts to files...\n')
+	if output_format == 'tsv':
+		with output.open('topology.tsv') as out_file:
+			write_dictionary('Compound_code\tMetabolite_name\tIndegree\tOutdegree\n', results[0].degree_dict, out_file)
+	else:
+		topology_lst = [[x] + results[0].degree_dict[x] for x in sorted(results[0].degree_dict.keys())]
+		write_output_rows(output, ['Compound_code', 'Metabolite_name', 'Indegree', 'Outdegree'], topology_lst, 'topology', output_format)
+	with output.open('KO_mapping.tsv') as out_file:
+		if batch == 'n':
+			write_dictionary_short('KO_code\tTranscripts\n', transcript_dict, out_file)
+		else:
+			mapping_lst = [[ko] + list(sample_matrix[index]) for index, ko in enumerate(all_KO_lst)]
+			write_list('KO_code\t' + '\t'.join(samples) + '\n', mapping_lst, out_file)
+	with output.open('input_metabolites.tsv') as out_file:
+		write_dictionary_list('KO_code\tCompound_codes\n', model.ko_input_dict, out_file)
+	with output.open('output_metabolites.tsv') as out_file:
+		write_dictionary_list('KO_code\tCompound_codes\n', model.ko_output_dict, out_file)
+	print('Done.\n')
+
+	#-----------------------------------------------------------------------------------#		
+
+	# Wrap everything up
+
+	# Report time if iterations are performed
+	end = time.time()
+	if end > 10:
+		duration = str(int(end - start))
+		print('\nCompleted in ' + duration + ' seconds.\n')
+	else :
+		print('\n')
+		
+	print('Output files located in: ' + output.location + '\n\n')
+
+	# Define calculation selection with a string
+	if iterations > 1:
+		iter_str = 'yes'
+	else:
+		iter_str = 'no'
+
+	time_unit = 'seconds'
+	if int(duration) >= 120:
+		duration = int(duration) // 60
+		time_unit = 'minutes'
+	if int(duration) >= 120:
+		duration = int(duration) // 60
+		time_unit = 'hours'
+
+	# Write parameters to a file
+	with output.open('parameters.txt') as parameter_file:
+		outputString = '''User Defined Parameters
+KO expression file: {ko}
+Graph name: {name}
+KEGG ortholog nodes: {kos}
+Substrate nodes: {substrate}
+Probability distribution generated: {iter}
+Permutations: {perms}
+Permutations performed: {performed}
+Compound permutations performed: {compound_performed} of {compound_perms}
+Adaptive stopping: {adaptive}
+Random seed: {seed}
+Unique permutations: {unique}
+Workers: {workers}
+Histogram resolution: {resolution}
+Graph cache: {cache}
+Output format: {output_format}
+Archive: {archive}
+Samples: {samples}
+Duration: {time} {tunit}
+'''.format(ko=str(KO_input_file), name=str(file_name), iter=iter_str, kos=str(len(model.KO_lst)), substrate=str(len(model.compound_lst)), perms=str(iterations), performed=','.join([str(x.permutations) for x in results]), compound_performed=','.join([str(x.compound_permutations) for x in results]), compound_perms=str(iterations * len(model.compound_lst)), adaptive=str(adaptive), seed=str(args.seed), unique=unique, workers=str(workers), resolution=str(args.resolution), cache=str(args.cache), output_format=output_format, archive=archive, samples=str(len(results)), time=str(duration), tunit=time_unit)
+		parameter_file.write(outputString)
+
+	# Archives are indexed once every member has been written
+	output.close()
@@ -0,0 +1,455 @@
+'''Array engine for crosstalk: a community's importance scores held as one species-by-compound matrix'''
+
+import sys
+import json
+import functools
+import concurrent.futures
+import numpy
+
+from .scoring import block_seeds
+
+#---------------------------------------------------------------------------------------#
+
+class ScoreMatrix(object):
+	'''Importance scores of every species in a community, one row per species and one column per compound
+
+	Compounds are sorted by code. A compound missing from a species, or removed by its p-value, q-value
+	or zero-score filters, is NaN in that species' row, so pairs share a compound where neither row is NaN.
+	'''
+
+	def __init__(self, species, codes, names, scores):
+
+		self.species = list(species)
+		self.codes = list(codes)
+		self.column_index = dict((code, column) for column, code in enumerate(self.codes))
+		self.names = list(names)
+		self.scores = scores
+
+	# Builds the matrix from per-species dictionaries of compound code to [name, score], as read by crosstalk.py
+	@classmethod
+	def from_dictionaries(cls, species, score_dicts):
+
+		matrix = cls([], [], [], numpy.zeros((0, 0)))
+		matrix.add_species(species, score_dicts)
+
+		return matrix
+
+	# Appends a row for each new species, adding columns for compounds not seen before so codes stay sorted
+	# Returns where each earlier column now sits, so arrays kept alongside the matrix can be moved to match
+	def add_species(self, species, score_dicts):
+
+		codes = sorted(set(self.codes).union(*score_dicts))
+		column_index = dict((code, column) for column, code in enumerate(codes))
+		old_columns = numpy.array([column_index[code] for code in self.codes], dtype=int)
+		names = [''] * len(codes)
+		for column, name in zip(old_columns.tolist(), self.names):
+			names[column] = name
+		scores = numpy.full((len(self.species) + len(score_dicts), len(codes)), numpy.nan)
+		scores[:len(self.species), old_columns] = self.scores
+
+		for row, score_dict in enumerate(score_dicts, len(self.species)):
+			columns = [column_index[code] for code in score_dict]
+			scores[row, columns] = [entry[1] for entry in score_dict.values()]
+			for column, entry in zip(columns, score_dict.values()):
+				names[column] = entry[0]
+
+		self.species += list(species)
+		self.codes = codes
+		self.column_index = column_index
+		self.names = names
+		self.scores = scores
+
+		return old_columns
+
+
+# Ratio, magnitude and interaction score of two species' compound scores, broadcast over any matching shapes
+# Both negative gives 0 for all three, opposite signs are scored on 2**|score| and negated, both positive are scored
+# on the raw scores; NaN in either input stays NaN in every output
+def pair_interactions(scores_1, scores_2):
+
+	with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+		exp_1 = numpy.power(2.0, numpy.abs(scores_1))
+		exp_2 = numpy.power(2.0, numpy.abs(scores_2))
+		negative_1 = scores_1 < 0
+		negative_2 = scores_2 < 0
+		mixed = negative_1 != negative_2
+		both_negative = negative_1 & negative_2
+
+		base_1 = numpy.where(mixed, exp_1, scores_1)
+		base_2 = numpy.where(mixed, exp_2, scores_2)
+		ratio = numpy.minimum(base_1 / base_2, base_2 / base_1)
+		magnitude = exp_1 + exp_2
+		interaction = numpy.log2(ratio * magnitude)
+		interaction = numpy.where(mixed, -interaction, interaction)
+
+	ratio = numpy.where(both_negative, 0.0, ratio)
+	magnitude = numpy.where(both_negative, 0.0, magnitude)
+	interaction = numpy.where(both_negative, 0.0, interaction)
+
+	return ratio, magnitude, interaction
+
+
+# Columns of one pair's strongest interactions, ordered from the largest interaction score down
+# Keeps the top largest positive and top most negative scores, those whose absolute score reaches threshold, or both
+#	when both are given; NaN entries, compounds the pair does not share, are never kept
+def extreme_interactions(interaction, top=None, threshold=None):
+
+	compounds = numpy.flatnonzero(~numpy.isnan(interaction))
+	values = interaction[compounds]
+	if threshold is not None:
+		keep = numpy.abs(values) >= threshold
+		compounds = compounds[keep]
+		values = values[keep]
+
+	if top is not None:
+		chosen = []
+		for tail in [numpy.flatnonzero(values > 0), numpy.flatnonzero(values < 0)]:
+			if len(tail) > top:
+				strength = numpy.abs(values[tail])
+				tail = tail[numpy.argpartition(-strength, top - 1)[:top]]
+			chosen.append(tail)
+		chosen = numpy.concatenate(chosen)
+		compounds = compounds[chosen]
+		values = values[chosen]
+
+	return compounds[numpy.argsort(-values, kind='stable')]
+
+
+# Labels each value with the most extreme two-tailed percentile level it falls beyond, from one numpy.percentile call
+# A value below percentile 100 - L or above percentile L is beyond level L, values inside every level are labelled 50
+# With ascending percentile edges instead, each value is labelled with the lower edge of the bin it falls in and values below
+#	the first edge with 0, an edge of 100 only closing the last bin
+def percentile_bins(values, levels=(60, 70, 80, 90), edges=None):
+
+	values = numpy.asarray(values, dtype=float)
+	if len(values) == 0: return numpy.zeros(0)
+
+	if edges is not None:
+		edges = numpy.asarray(edges, dtype=float)
+		edges = edges[edges < 100.0]
+		if len(edges) == 0: return numpy.zeros(len(values))
+		return numpy.concatenate([[0.0], edges])[numpy.digitize(values, numpy.percentile(values, edges))]
+
+	levels = numpy.sort(numpy.asarray(levels, dtype=float))
+
+	cuts = numpy.percentile(values, numpy.concatenate([100.0 - levels, levels]))
+	lower_cuts = cuts[:len(levels)][::-1]
+	upper_cuts = cuts[len(levels):]
+
+	# Levels are nested, so counting the cuts a value is beyond in each tail gives the index of its most extreme level
+	beyond = numpy.maximum(len(levels) - numpy.digitize(values, lower_cuts), numpy.digitize(values, upper_cuts, right=True))
+
+	return numpy.concatenate([[50.0], levels])[beyond]
+
+
+# Splits scores into |score|, 2**|score|, log2|score| and sign, so permuted replicates transform each species once rather than each pair
+def transformed_scores(scores):
+
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		magnitude = numpy.abs(scores)
+		return magnitude, numpy.exp2(magnitude), numpy.log2(magnitude), scores < 0
+
+
+# Interaction scores from two transformed score arrays, algebraically the same as pair_interactions in fewer array passes
+# For opposite signs log2(ratio * magnitude) is log2(2**|s1| + 2**|s2|) - ||s1| - |s2||, for two positive scores the ratio
+#	term is -|log2 s1 - log2 s2| instead
+def transformed_interactions(transformed_1, transformed_2):
+
+	abs_1, exp_1, log_1, negative_1 = transformed_1
+	abs_2, exp_2, log_2, negative_2 = transformed_2
+
+	total = numpy.log2(exp_1 + exp_2)
+	interaction = numpy.where(negative_1 != negative_2, numpy.abs(abs_1 - abs_2) - total, total - numpy.abs(log_1 - log_2))
+
+	return numpy.where(negative_1 & negative_2, 0.0, interaction)
+
+
+# Interactions of every unordered pair of species once, since ratio, magnitude and interaction do not depend on the order
+# Computed a tile of rows at a time so memory stays bounded for large communities, each row scored only against the columns 
+#	after it, giving (row, partners, ratio, magnitude, interaction) with arrays in the order of partners
+# Only the given rows and columns are paired when they are given
+def unordered_pair_interactions(scores, block_elements=4194304, rows=None, columns=None):
+
+	rows = numpy.arange(scores.shape[0]) if rows is None else numpy.asarray(rows, dtype=int)
+	columns = numpy.arange(scores.shape[0]) if columns is None else numpy.sort(numpy.asarray(columns, dtype=int))
+	tile = max(1, block_elements // max(1, scores.size))
+
+	for start in range(0, len(rows), tile):
+		tile_rows = rows[start:start + tile]
+		partners = columns[columns > tile_rows.min()]
+		if len(partners) == 0: continue
+		ratio, magnitude, interaction = pair_interactions(scores[tile_rows, None, :], scores[None, partners, :])
+		for offset, row in enumerate(tile_rows.tolist()):
+			keep = partners > row
+			if keep.any():
+				yield row, partners[keep], ratio[offset, keep], magnitude[offset, keep], interaction[offset, keep]
+
+
+# Cumulative, consumption and production totals of each compound across the community, on the 2**|score| scale
+def community_totals(scores):
+
+	signed = numpy.sign(scores) * numpy.power(2.0, numpy.abs(scores))
+	present = ~numpy.isnan(signed)
+
+	cumulative = numpy.where(present, signed, 0.0).sum(axis=0)
+	consumption = numpy.where(present & (signed > 0), signed, 0.0).sum(axis=0)
+	production = numpy.where(present & (signed < 0), signed, 0.0).sum(axis=0)
+
+	return cumulative, consumption, production
+
+
+# Shuffle each species' scores among the compounds it scores, giving a (species, compounds, replicates) block
+# Which compounds each species scores is kept, so every pair shares the same compounds in every replicate, and replicates
+#	are the last axis so gathering a pair's compounds copies contiguous rows
+def permuted_scores(scores, block_size, block_seed):
+
+	generator = numpy.random.default_rng(block_seed)
+	block = numpy.repeat(scores[:, :, numpy.newaxis], block_size, axis=2)
+	for row in range(scores.shape[0]):
+		present = numpy.flatnonzero(~numpy.isnan(scores[row]))
+		block[row, present] = generator.permuted(block[row, present], axis=0)
+
+	return block
+
+
+# Number of compounds each pair of species shares, one count per pair of rows and columns
+def shared_counts(present, pair_rows, pair_columns):
+
+	present = present.astype(numpy.float64)
+
+	return numpy.rint(present.dot(present.T)[pair_rows, pair_columns]).astype(int)
+
+
+# Runs of consecutive pairs whose shared compounds fit within an element budget, as (start, stop) positions in the pairs
+# Ends are the cumulative shared counts of the pairs, and a pair larger than the budget gets a run of its own
+def pair_tiles(ends, budget):
+
+	tiles = []
+	start = 0
+	while start < len(ends):
+		offset = ends[start - 1] if start > 0 else 0
+		stop = max(start + 1, int(numpy.searchsorted(ends, offset + budget, side='right')))
+		tiles.append((start, stop))
+		start = stop
+
+	return tiles
+
+
+# Interactions of a run of pairs at the compounds they share, from the transformed scores of every species
+# Returns which pair of the run each entry belongs to with its compound and interaction, flat in the order of pairs and then compounds,
+#	with the position of each pair's first entry
+def pair_entries(transformed, present, pair_rows, pair_columns):
+
+	tile_pairs, compounds = numpy.nonzero(present[pair_rows] & present[pair_columns])
+	rows = pair_rows[tile_pairs]
+	columns = pair_columns[tile_pairs]
+	interaction = transformed_interactions([x[rows, compounds] for x in transformed], [x[columns, compounds] for x in transformed])
+	first = numpy.flatnonzero(numpy.r_[True, tile_pairs[1:] != tile_pairs[:-1]]) if len(tile_pairs) > 0 else numpy.zeros(0, dtype=int)
+
+	return tile_pairs, compounds, interaction, first
+
+
+# Permute one block of replicates and count how many permuted interactions are at or above and at or below the observed ones,
+#	for every tested pair and shared compound and for each pair's mean interaction; kept at module level so it can be sent to worker processes
+# Observed interactions are recomputed here a tile of pairs at a time, so workers are sent the score matrix rather than every interaction
+# Counts are flat over the shared entries of the pairs, in the order of pairs and then compounds
+def crosstalk_permutation_block(scores, pair_rows, pair_columns, block_elements, block_size, block_seed):
+
+	block = transformed_scores(permuted_scores(scores, block_size, block_seed))
+	transformed = transformed_scores(scores)
+	present = ~numpy.isnan(scores)
+	counts = shared_counts(present, pair_rows, pair_columns)
+	ends = numpy.cumsum(counts)
+	upper = numpy.zeros(counts.sum(), dtype=numpy.int32)
+	lower = numpy.zeros(counts.sum(), dtype=numpy.int32)
+	pair_upper = numpy.zeros(len(pair_rows), dtype=numpy.int32)
+	pair_lower = numpy.zeros(len(pair_rows), dtype=numpy.int32)
+
+	# Each tile of pairs is gathered into one flat run sized to the element budget, with each pair's compounds contiguous
+	for start, stop in pair_tiles(ends, block_elements // block_size):
+		tile_pairs, compounds, target, first = pair_entries(transformed, present, pair_rows[start:stop], pair_columns[start:stop])
+		if len(tile_pairs) == 0: continue
+		offset = ends[start - 1] if start > 0 else 0
+		rows = pair_rows[start:stop][tile_pairs]
+		columns = pair_columns[start:stop][tile_pairs]
+
+		interaction = transformed_interactions([x[rows, compounds] for x in block], [x[columns, compounds] for x in block])
+		target = target[:, numpy.newaxis]
+		tolerance = 1e-6 * (1.0 + numpy.abs(target))
+		upper[offset:offset + len(rows)] = (interaction >= target - tolerance).sum(axis=1)
+		lower[offset:offset + len(rows)] = (interaction <= target + tolerance).sum(axis=1)
+
+		tested = start + tile_pairs[first]
+		pair_means = numpy.add.reduceat(interaction, first, axis=0, dtype=numpy.float64) / counts[tested][:, numpy.newaxis]
+		target = (numpy.add.reduceat(target[:, 0], first, dtype=numpy.float64) / counts[tested])[:, numpy.newaxis]
+		tolerance = 1e-6 * (1.0 + numpy.abs(target))
+		pair_upper[tested] = (pair_means >= target - tolerance).sum(axis=1)
+		pair_lower[tested] = (pair_means <= target + tolerance).sum(axis=1)
+
+	return upper, lower, pair_upper, pair_lower
+
+
+class PairSignificance(object):
+	'''Permutation p-values of a set of unordered species pairs, for each pair's interaction at every compound it shares and for its mean
+
+	Compound p-values are held only for the compounds each pair shares, one flat run per pair in the order pairs were tested, 
+	so memory follows the shared entries rather than every pair and compound of the community.
+	'''
+
+	def __init__(self, present, pair_rows, pair_columns, ends, p_values, means, pair_p_values):
+
+		self.present = present
+		self.pair_rows = pair_rows
+		self.pair_columns = pair_columns
+		self.pair_index = dict(((row, column), index) for index, (row, column) in enumerate(zip(pair_rows.tolist(), pair_columns.tolist())))
+		self.ends = ends
+		self.p_values = p_values
+		self.means = means
+		self.pair_p_values = pair_p_values
+
+	# P-value of one pair's interaction at every compound, NaN where it shares none, for the species in either order
+	def compound_p_values(self, row, column):
+
+		index = self.pair_index[(min(row, column), max(row, column))]
+		values = numpy.full(self.present.shape[1], numpy.nan)
+		start = self.ends[index - 1] if index > 0 else 0
+		values[self.present[row] & self.present[column]] = self.p_values[start:self.ends[index]]
+
+		return values
+
+
+# Two-sided empirical p-values of every pair's interaction at each shared compound, and of each pair's mean interaction,
+#	against replicates where every species' scores are shuffled among its own compounds
+# Replicates are drawn in seeded blocks spread across worker processes, so results for a seed do not depend on workers
+# Interactions do not depend on the order of a pair, so each unordered pair is tested once: every pair of species, or those
+#	marked in either orientation by a (species, species) boolean mask
+def crosstalk_null(scores, iterations, seed=None, workers=1, block_size=100, block_elements=1048576, pairs=None):
+
+	# Scores are permuted as float32 like the importance score null, so a small tolerance keeps exact ties, and observed
+	#	interactions go through the same transform as the permuted ones
+	scores = numpy.asarray(scores, dtype=numpy.float32)
+	if pairs is None:
+		pairs = numpy.ones((scores.shape[0], scores.shape[0]), dtype=bool)
+	pairs = numpy.asarray(pairs, dtype=bool)
+	pair_rows, pair_columns = numpy.nonzero(numpy.triu(pairs | pairs.T, 1))
+	present = ~numpy.isnan(scores)
+	counts = shared_counts(present, pair_rows, pair_columns)
+	ends = numpy.cumsum(counts)
+
+	# Mean observed interaction of each pair, summed the same way as the permuted means
+	transformed = transformed_scores(scores)
+	means = numpy.full(len(pair_rows), numpy.nan)
+	for start, stop in pair_tiles(ends, block_elements):
+		tile_pairs, compounds, interaction, first = pair_entries(transformed, present, pair_rows[start:stop], pair_columns[start:stop])
+		if len(tile_pairs) == 0: continue
+		tested = start + tile_pairs[first]
+		means[tested] = numpy.add.reduceat(interaction, first, dtype=numpy.float64) / counts[tested]
+
+	print('Permuting compound scores and calculating interactions...\n')
+	sys.stdout.write('\rProgress: 0.0%')
+	sys.stdout.flush()
+	blocks = block_seeds(seed, iterations, block_size)
+	count_block = functools.partial(crosstalk_permutation_block, scores, pair_rows, pair_columns, block_elements)
+
+	executor = None
+	if workers > 1:
+		executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+		counted_blocks = executor.map(count_block, [x[0] for x in blocks], [x[1] for x in blocks])
+	else:
+		counted_blocks = map(count_block, [x[0] for x in blocks], [x[1] for x in blocks])
+
+	upper = numpy.zeros(counts.sum(), dtype=numpy.int32)
+	lower = numpy.zeros(len(upper), dtype=numpy.int32)
+	pair_upper = numpy.zeros(len(pair_rows), dtype=numpy.int64)
+	pair_lower = numpy.zeros(len(pair_rows), dtype=numpy.int64)
+	done = 0
+	for (block_size, block_seed), block_counts in zip(blocks, counted_blocks):
+		upper += block_counts[0]
+		lower += block_counts[1]
+		pair_upper += block_counts[2]
+		pair_lower += block_counts[3]
+		done += block_size
+		sys.stdout.write('\rProgress: ' + str(float("%.3f" % (100.0 * done / iterations))) + '%')
+		sys.stdout.flush()
+
+	if executor is not None:
+		executor.shutdown()
+	sys.stdout.write('\rDone.                       \n\n')
+
+	# Converted in place, as the shared entries of every pair are the largest arrays of the run
+	p_values = numpy.minimum(upper, lower, out=upper).astype(numpy.float64)
+	del upper, lower
+	p_values += 1.0
+	p_values *= 2.0
+	p_values /= iterations + 1.0
+	numpy.minimum(p_values, 1.0, out=p_values)
+	pair_p_values = numpy.minimum(2.0 * (numpy.minimum(pair_upper, pair_lower) + 1.0) / (iterations + 1.0), 1.0)
+	pair_p_values[numpy.isnan(means)] = numpy.nan
+
+	return PairSignificance(present, pair_rows, pair_columns, ends, p_values, means, pair_p_values)
+
+
+class Community(object):
+	'''Score matrix of a community with its compound totals and pair significance, saved between crosstalk runs
+
+	Species can then be added without reading existing species again or recomputing their pairs: only pairs with a
+	new species are scored, and the new rows are added to the cumulative, consumption and production totals. The
+	cutoffs the scores were read with are kept in parameters, since later species must be read the same way.
+	'''
+
+	def __init__(self, parameters):
+
+		self.parameters = dict(parameters)
+		self.matrix = ScoreMatrix([], [], [], numpy.zeros((0, 0)))
+		self.cumulative = numpy.zeros(0)
+		self.consumption = numpy.zeros(0)
+		self.production = numpy.zeros(0)
+		self.pair_means = numpy.zeros((0, 0))
+		self.pair_p_values = numpy.zeros((0, 0))
+
+	# Adds species to the matrix and their scores to the community totals, returning their rows
+	def add_species(self, species, score_dicts):
+
+		start = len(self.matrix.species)
+		old_columns = self.matrix.add_species(species, score_dicts)
+		cumulative, consumption, production = community_totals(self.matrix.scores[start:])
+		for name, added in [('cumulative', cumulative), ('consumption', consumption), ('production', production)]:
+			totals = numpy.zeros(len(self.matrix.codes))
+			totals[old_columns] = getattr(self, name)
+			setattr(self, name, totals + added)
+
+		# Pairs with a new species have no significance yet
+		for name in ['pair_means', 'pair_p_values']:
+			pair_values = numpy.full((len(self.matrix.species), len(self.matrix.species)), numpy.nan)
+			pair_values[:start, :start] = getattr(self, name)
+			setattr(self, name, pair_values)
+
+		return list(range(start, len(self.matrix.species)))
+
+	# Boolean (species, species) mask of the ordered pairs that include at least one of the given rows
+	def new_pairs(self, rows):
+
+		new = numpy.zeros(len(self.matrix.species), dtype=bool)
+		new[rows] = True
+		pairs = new[:, numpy.newaxis] | new[numpy.newaxis, :]
+		numpy.fill_diagonal(pairs, False)
+
+		return pairs
+
+	def save(self, file_name):
+
+		with open(file_name, 'wb') as state_file:
+			numpy.savez(state_file, parameters=json.dumps(self.parameters, sort_keys=True), species=numpy.array(self.matrix.species, dtype=str), 
+				codes=numpy.array(self.matrix.codes, dtype=str), names=numpy.array(self.matrix.names, dtype=str), scores=self.matrix.scores, 
+				cumulative=self.cumulative, consumption=self.consumption, production=self.production, pair_means=self.pair_means, pair_p_values=self.pair_p_values)
+
+	@classmethod
+	def load(cls, file_name):
+
+		with numpy.load(file_name) as state:
+			community = cls(json.loads(str(state['parameters'])))
+			community.matrix = ScoreMatrix(state['species'].tolist(), state['codes'].tolist(), state['names'].tolist(), state['scores'].reshape(len(state['species']), len(state['codes'])))
+			for name in ['cumulative', 'consumption', 'production', 'pair_means', 'pair_p_values']:
+				setattr(community, name, state[name])
+
+		return community
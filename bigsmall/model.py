@@ -0,0 +1,292 @@
+'''In-process bigSMALL models that can be reused across many expression profiles'''
+
+import collections
+import numpy
+
+from .reference import load_reference, compound_names
+from .network import open_expression, transcription_dictionary, network_graph
+from .cache import cached_graph
+from .scoring import importance_scores, transcription_scores, probability_distribution, confidence_interval
+
+#---------------------------------------------------------------------------------------#		
+
+# Structures produced for one expression profile, interval_lst and final_data are None without permutations
+# permutations is the most permutations any compound was scored against, which adaptive runs and duplicate rejection can reduce,
+#	and compound_permutations the total over every compound, which shows how much earlier adaptive compounds stopped
+# Scores in score_dict are unrounded, they are rounded to 3 decimals only when written out
+SampleResult = collections.namedtuple('SampleResult', ['score_dict', 'degree_dict', 'interval_lst', 'final_data', 'permutations', 'compound_permutations'])
+
+
+class Model(object):
+	'''Bipartite enzyme-to-compound graph for one set of KOs, built once and scored against any expression profile
+
+	With a Cache, the graph is loaded from disk when the same KO set was already translated against the same reference, 
+	and seeded permutation nulls are reused across runs with the same transcript multiset.
+	'''
+
+	def __init__(self, KOs, reference=None, cache=None):
+
+		if reference is None:
+			reference = load_reference()
+		elif isinstance(reference, str):
+			reference = load_reference(reference)
+		self.reference = reference
+		self.cache = cache
+
+		if cache is None:
+			graph, self.key_errors = network_graph(KOs, reference)
+		else:
+			graph, self.key_errors = cached_graph(cache, KOs, reference)
+		self.build(graph)
+
+	# Derive the node lists, incidence matrices and topology used for scoring from a graph
+	def build(self, graph):
+
+		self.graph = graph
+		self.compound_lst = [str(x) for x in self.graph.compound_ids]
+		self.KO_lst = [str(x) for x in self.graph.ko_ids]
+		self.compound_name_dict = compound_names(self.reference, self.compound_lst)
+		self.incidence = self.graph.incidence()
+
+		# Topology is shared by every expression profile scored against this graph
+		indegree, outdegree = self.graph.degrees()
+		self.degree_dict = {}
+		for index, compound in enumerate(self.incidence[0]):
+			self.degree_dict[compound] = [self.compound_name_dict[compound], int(indegree[index]), int(outdegree[index])]
+
+		# KO columns of the incidence matrices, for rescoring only the neighbours of changed KOs
+		self.ko_index = dict((ko, index) for index, ko in enumerate(self.KO_lst))
+		self.ko_columns = (self.incidence[1].tocsc(), self.incidence[2].tocsc())
+
+	# Extend the graph with KOs that have not been looked up yet, returns True if any of them added edges
+	def add_kos(self, KOs):
+
+		queried = set(self.graph.query_kos)
+		KOs = [x for x in KOs if not x in queried]
+		if len(KOs) == 0: return False
+
+		graph, key_errors = network_graph(KOs, self.reference)
+		self.key_errors += key_errors
+
+		# KOs without edges are only recorded as queried, keeping the same graph so samples sharing it need not rescore
+		if len(graph.ko_ids) == 0:
+			self.graph.query_kos += [x for x in graph.query_kos if not x in queried]
+			return False
+		self.build(self.graph.union(graph))
+
+		return True
+
+	# Unique edges as [source, target] code pairs, built from the graph when needed
+	@property
+	def network_list(self):
+
+		return self.graph.edge_list()
+
+	# Per-KO lists of input compound codes, built from the graph when needed
+	@property
+	def ko_input_dict(self):
+
+		return self.graph.adjacency()[0]
+
+	# Per-KO lists of output compound codes, built from the graph when needed
+	@property
+	def ko_output_dict(self):
+
+		return self.graph.adjacency()[1]
+
+	# Restrict expression to the KOs in the graph, KOs without measured expression contribute no transcription
+	def transcripts(self, transcript_dict):
+
+		return dict((ko, transcript_dict.get(ko, 0.0)) for ko in self.KO_lst)
+
+	# Calculate importance scores and degree of each compound node from measured expression
+	def score(self, transcript_dict):
+
+		substrate_lst, input_matrix, output_matrix = self.incidence
+		transcript_dict = self.transcripts(transcript_dict)
+		expression = numpy.array([transcript_dict[ko] for ko in self.KO_lst], dtype=float)
+		scores = importance_scores(input_matrix, output_matrix, expression)[0]
+
+		score_dict = {}
+		for index, compound in enumerate(substrate_lst):
+			score_dict[compound] = [self.compound_name_dict[compound], float(scores[index])]
+
+		# Topology does not depend on expression, so every result shares the model's degree_dict rather than a copy
+		return score_dict, self.degree_dict
+
+	# Score an expression profile and, if iterations are requested, compare each compound to permuted expression
+	def run(self, transcript_dict, iterations=1000, seed=None, unique=False, workers=1, resolution=None, adaptive=0):
+
+		score_dict, degree_dict = self.score(transcript_dict)
+		if iterations < 1:
+			return SampleResult(score_dict, degree_dict, None, None, 0, 0)
+
+		transcript_dict = self.transcripts(transcript_dict)
+		seq_total = sum(transcript_dict.values())
+		seq_max = max(list(transcript_dict.values()) + [0])
+		interval_lst, p_values, counts = probability_distribution(None, None, degree_dict, self.KO_lst, self.compound_name_dict, seq_total, seq_max, self.compound_lst, transcript_dict, iterations, seed, unique, self.incidence, workers, resolution, adaptive, score_dict, self.cache)
+		final_data = confidence_interval(score_dict, interval_lst, degree_dict, p_values)
+
+		return SampleResult(score_dict, degree_dict, interval_lst, final_data, int(counts.max(initial=0)), int(counts.sum()))
+
+	# Score every column of a KO-by-sample expression matrix in one pass, then test each sample against its own permutations
+	def run_batch(self, KOs, matrix, iterations=1000, seed=None, unique=False, workers=1, resolution=None, adaptive=0):
+
+		substrate_lst, input_matrix, output_matrix = self.incidence
+
+		# Align matrix rows to the KOs in the graph, KOs without measured expression contribute no transcription
+		row_index = dict((ko, index) for index, ko in enumerate(KOs))
+		sample_matrix = numpy.zeros((len(self.KO_lst), matrix.shape[1]))
+		for index, ko in enumerate(self.KO_lst):
+			if ko in row_index: sample_matrix[index] = matrix[row_index[ko]]
+
+		score_matrix = importance_scores(input_matrix, output_matrix, sample_matrix)[0]
+
+		degree_dict = self.degree_dict
+
+		# Independent random streams for each sample, reproducible from a single seed, and left unseeded 
+		#	without one so that unrepeatable nulls are not cached
+		if seed is None:
+			sample_seeds = [None] * matrix.shape[1]
+		else:
+			sample_seeds = numpy.random.SeedSequence(seed).spawn(matrix.shape[1])
+
+		results = []
+		for sample in range(matrix.shape[1]):
+			score_dict = {}
+			for index, compound in enumerate(substrate_lst):
+				score_dict[compound] = [self.compound_name_dict[compound], float(score_matrix[index, sample])]
+
+			if iterations < 1:
+				results.append(SampleResult(score_dict, degree_dict, None, None, 0, 0))
+				continue
+
+			transcript_dict = dict(zip(self.KO_lst, sample_matrix[:, sample]))
+			seq_total = float(sample_matrix[:, sample].sum())
+			seq_max = float(sample_matrix[:, sample].max(initial=0))
+			interval_lst, p_values, counts = probability_distribution(None, None, degree_dict, self.KO_lst, self.compound_name_dict, seq_total, seq_max, self.compound_lst, transcript_dict, iterations, sample_seeds[sample], unique, self.incidence, workers, resolution, adaptive, score_dict, self.cache)
+			final_data = confidence_interval(score_dict, interval_lst, degree_dict, p_values)
+			results.append(SampleResult(score_dict, degree_dict, interval_lst, final_data, int(counts.max(initial=0)), int(counts.sum())))
+
+		return results
+
+
+class Sample(object):
+	'''Expression profile scored against a Model, kept so that revised expression only rescores the compounds it touches
+
+	Summed input and output transcription of every compound are held as arrays, so a change to one KO 
+	updates just the compounds adjacent to it. KOs new to the model extend its graph first, which 
+	rescores the whole profile. Significance belongs to the expression it was permuted from, so it is 
+	dropped by an update unless the null is refreshed.
+	'''
+
+	def __init__(self, model, transcript_dict, iterations=1000, seed=None, unique=False, workers=1, resolution=None, adaptive=0):
+
+		self.model = model
+		self.expression = dict(transcript_dict)
+		self.settings = (iterations, seed, unique, workers, resolution, adaptive)
+		self.model.add_kos(list(self.expression.keys()))
+		self.rescore()
+		self.refresh()
+
+	# Sum transcription around every compound from scratch, needed whenever the graph changes
+	def rescore(self):
+
+		substrate_lst, input_matrix, output_matrix = self.model.incidence
+		self.graph = self.model.graph
+		self.transcripts = numpy.array([self.expression.get(ko, 0.0) for ko in self.model.KO_lst], dtype=float)
+		self.input_transcription = input_matrix.dot(self.transcripts)
+		self.output_transcription = output_matrix.dot(self.transcripts)
+		self.indegree = numpy.array([self.model.degree_dict[x][1] for x in substrate_lst], dtype=float)
+		self.outdegree = numpy.array([self.model.degree_dict[x][2] for x in substrate_lst], dtype=float)
+		self.scores = transcription_scores(self.input_transcription, self.output_transcription, self.indegree, self.outdegree)
+		self.interval_lst = None
+		self.final_data = None
+		self.permutations = 0
+		self.compound_permutations = 0
+
+	# Rescore if the model's graph has grown through another sample sharing it, returns True if it had
+	def current(self):
+
+		if self.model.graph is self.graph: return False
+		self.rescore()
+
+		return True
+
+	# Add a dictionary of KO expression changes, returns the compounds whose scores were recalculated
+	def update(self, delta, refresh=False):
+
+		for ko in delta:
+			self.expression[ko] = self.expression.get(ko, 0.0) + delta[ko]
+
+		self.model.add_kos(list(delta.keys()))
+		if self.current():
+			changed = numpy.arange(len(self.scores))
+		else:
+			changed = []
+			input_columns, output_columns = self.model.ko_columns
+			for ko in delta:
+				if not ko in self.model.ko_index: continue
+				column = self.model.ko_index[ko]
+				self.transcripts[column] += delta[ko]
+				for columns, transcription in [(input_columns, self.input_transcription), (output_columns, self.output_transcription)]:
+					rows = columns.indices[columns.indptr[column]:columns.indptr[column + 1]]
+					transcription[rows] += delta[ko] * columns.data[columns.indptr[column]:columns.indptr[column + 1]]
+					changed.append(rows)
+			changed = numpy.unique(numpy.concatenate(changed + [numpy.zeros(0, dtype=int)]))
+			self.scores[changed] = transcription_scores(self.input_transcription[changed], self.output_transcription[changed], self.indegree[changed], self.outdegree[changed])
+			self.interval_lst = None
+			self.final_data = None
+			self.permutations = 0
+			self.compound_permutations = 0
+
+		if refresh: self.refresh()
+
+		return [self.model.incidence[0][x] for x in changed]
+
+	# Permute the current expression to recompute intervals and significance, if iterations were requested
+	def refresh(self):
+
+		iterations, seed, unique, workers, resolution, adaptive = self.settings
+		if iterations < 1: return
+
+		self.current()
+		score_dict, degree_dict = self.result[:2]
+		transcript_dict = dict(zip(self.model.KO_lst, self.transcripts))
+		seq_total = float(self.transcripts.sum())
+		seq_max = float(self.transcripts.max(initial=0))
+		self.interval_lst, p_values, counts = probability_distribution(None, None, degree_dict, self.model.KO_lst, self.model.compound_name_dict, seq_total, seq_max, self.model.compound_lst, transcript_dict, iterations, seed, unique, self.model.incidence, workers, resolution, adaptive, score_dict, self.model.cache)
+		self.permutations = int(counts.max(initial=0))
+		self.compound_permutations = int(counts.sum())
+		self.final_data = confidence_interval(score_dict, self.interval_lst, degree_dict, p_values)
+
+	# Current structures in the same form as Model.run
+	@property
+	def result(self):
+
+		self.current()
+		score_dict = {}
+		for index, compound in enumerate(self.model.incidence[0]):
+			score_dict[compound] = [self.model.compound_name_dict[compound], float(self.scores[index])]
+
+		return SampleResult(score_dict, self.model.degree_dict, self.interval_lst, self.final_data, self.permutations, self.compound_permutations)
+
+
+# Build one graph from the union of KOs in a KO-by-sample expression matrix and score every sample against it
+def run_batch(KOs, matrix, reference=None, iterations=1000, seed=None, unique=False, workers=1, resolution=None, adaptive=0, cache=None):
+
+	model = Model(KOs, reference, cache)
+
+	return model, model.run_batch(KOs, matrix, iterations, seed, unique, workers, resolution, adaptive)
+
+
+# Build the graph for one expression profile and score it, expression is a KO dictionary or a KO expression file
+def run_sample(expression, reference=None, iterations=1000, seed=None, unique=False, workers=1, resolution=None, adaptive=0, cache=None):
+
+	if isinstance(expression, str):
+		with open_expression(expression) as KO_file:
+			expression = transcription_dictionary(KO_file)[0]
+
+	model = Model(list(expression.keys()), reference, cache)
+
+	return model.run(expression, iterations, seed, unique, workers, resolution, adaptive)
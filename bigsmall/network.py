@@ -0,0 +1,341 @@
+'''Translation of KEGG orthologs into the bipartite enzyme-to-compound graph'''
+
+import io
+import gzip
+import itertools
+import warnings
+import numpy
+import scipy.sparse
+
+#---------------------------------------------------------------------------------------#		
+
+# Open a KO expression file as text, decompressing gzip input on the fly
+def open_expression(file_name):
+
+	with open(file_name, 'rb') as test_file:
+		gzipped = test_file.read(2) == b'\x1f\x8b'
+
+	if gzipped:
+		return gzip.open(file_name, 'rt')
+	else:
+		return open(file_name, 'r')
+
+
+# Sum the rows of an expression array that share a code, grouping on the raw bytes of each code
+def group_sum(codes, expression):
+
+	# Codes are padded to whole 64-bit words so they can be sorted as integers rather than as strings
+	width = -(-codes.dtype.itemsize // 8) * 8
+	codes = numpy.ascontiguousarray(codes.astype('S' + str(width)))
+	words = codes.view(numpy.uint64).reshape(len(codes), width // 8)
+	# Words that are padding in every code carry no information, dropping them leaves a single word for KO codes
+	words = words[:, words.any(axis=0)]
+	if words.shape[1] == 1:
+		order = numpy.argsort(words[:, 0], kind='stable')
+	else:
+		order = numpy.lexsort(words.T[::-1])
+
+	sorted_words = words[order]
+	starts = numpy.concatenate([[True], numpy.any(sorted_words[1:] != sorted_words[:-1], axis=1)])
+	groups = numpy.cumsum(starts) - 1
+	sums = numpy.array([numpy.bincount(groups, weights=expression[order, x], minlength=int(starts.sum())) for x in range(expression.shape[1])]).T
+
+	return codes[order][starts], sums.reshape(int(starts.sum()), expression.shape[1])
+
+
+# Parse whitespace-delimited KO expression lines in blocks of chunk_lines, so memory does not grow with the file
+# Yields the KO codes in each block with their summed expression, one column per expression column
+def expression_chunks(KO_file, columns=1, chunk_lines=1000000):
+
+	dtype = [('ko', 'S32')] + [('expression' + str(x), 'f8') for x in range(columns)]
+	while True:
+		lines = list(itertools.islice(KO_file, chunk_lines))
+		if len(lines) == 0: break
+
+		# Blank lines are skipped, numpy warns that they are not counted as rows
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			table = numpy.loadtxt(lines, dtype=dtype, comments=None, usecols=range(columns + 1), ndmin=1)
+		if len(table) == 0: continue
+
+		codes = numpy.ascontiguousarray(table['ko'])
+		expression = numpy.stack([table['expression' + str(x)] for x in range(columns)], axis=1)
+		# Codes filling the whole field may have been cut short, so those blocks take their codes at full width
+		if numpy.any(codes.view(numpy.uint8).reshape(len(codes), -1)[:, -1] != 0):
+			codes = numpy.array([x.split()[0].encode('utf-8') for x in lines if len(x.split()) > 0])
+
+		codes, sums = group_sum(codes, expression)
+		yield [x.decode('utf-8').strip('ko:') for x in codes], sums
+
+
+# Create a dictionary for transcript value associated with its KO
+def transcription_dictionary(KO_file, chunk_lines=1000000):
+	
+	transcript_dict = {}  # Dictionary for transcription
+	for kos, sums in expression_chunks(KO_file, 1, chunk_lines):
+		for ko, expression in zip(kos, sums[:, 0].tolist()):
+			transcript_dict[ko] = transcript_dict.get(ko, 0.0) + expression
+
+	seq_total = sum(transcript_dict.values())  # Total number of reads
+	seq_max = max(list(transcript_dict.values()) + [0])  # Highest single number of reads
+	
+	return transcript_dict, seq_total, seq_max
+
+
+# Create a KO-by-sample expression matrix from a table whose header row names each sample column
+def expression_matrix(KO_file, chunk_lines=1000000):
+
+	samples = KO_file.readline().split()[1:]
+	transcript_dict = {}  # Dictionary for transcription across samples
+
+	for kos, sums in expression_chunks(KO_file, len(samples), chunk_lines):
+		for ko, expression in zip(kos, sums):
+			if not ko in transcript_dict:
+				transcript_dict[ko] = expression
+			else:
+				transcript_dict[ko] = transcript_dict[ko] + expression
+
+	KO_lst = sorted(transcript_dict.keys())
+	matrix = numpy.array([transcript_dict[ko] for ko in KO_lst]).reshape(len(KO_lst), len(samples))
+
+	return KO_lst, samples, matrix
+
+
+class Graph(object):
+	'''Bipartite enzyme-to-compound graph with KO and compound codes interned to integer indices
+
+	Input edges (compound consumed by a KO) and output edges (compound produced by a KO) are kept as 
+	parallel int32 arrays of KO and compound indices, in the order they were read from the reference 
+	and with repeated edges retained, so degree and transcription sums match the per-KO compound lists.
+	'''
+
+	__slots__ = ('ko_ids', 'compound_ids', 'query_kos', 'substrate', 'input_ko', 'input_compound', 'output_ko', 'output_compound')
+
+	def __init__(self, ko_ids, compound_ids, query_kos, input_ko, input_compound, output_ko, output_compound):
+
+		self.ko_ids = ko_ids  # Sorted KO codes with at least one translated reaction
+		self.compound_ids = compound_ids  # Sorted codes of every compound in the graph
+		self.query_kos = query_kos  # Every KO that was looked up, translated or not
+		self.substrate = numpy.array([x[0] == 'C' for x in compound_ids], dtype=bool)
+		self.input_ko = input_ko
+		self.input_compound = input_compound
+		self.output_ko = output_ko
+		self.output_compound = output_compound
+
+	# Graph of both KO sets, with the edges of each remapped onto the union of their KO and compound codes
+	def union(self, other):
+
+		ko_ids = numpy.union1d(self.ko_ids, other.ko_ids).astype(str)
+		compound_ids = numpy.union1d(self.compound_ids, other.compound_ids).astype(str)
+
+		queried = set(self.query_kos)
+		query_kos = self.query_kos + [x for x in other.query_kos if not x in queried]
+
+		edges = []
+		for ko_array, compound_array in [('input_ko', 'input_compound'), ('output_ko', 'output_compound')]:
+			edges.append(numpy.concatenate([numpy.searchsorted(ko_ids, x.ko_ids)[getattr(x, ko_array)] for x in [self, other]]).astype(numpy.int32))
+			edges.append(numpy.concatenate([numpy.searchsorted(compound_ids, x.compound_ids)[getattr(x, compound_array)] for x in [self, other]]).astype(numpy.int32))
+
+		return Graph(ko_ids, compound_ids, query_kos, edges[0], edges[1], edges[2], edges[3])
+
+	# Unique directed edges as [source, target] code pairs, compound to KO for inputs and KO to compound for outputs
+	def edge_list(self):
+
+		network_list = []
+		for edge in numpy.unique(numpy.stack([self.input_compound, self.input_ko]), axis=1).T:
+			network_list.append([str(self.compound_ids[edge[0]]), str(self.ko_ids[edge[1]])])
+		for edge in numpy.unique(numpy.stack([self.output_ko, self.output_compound]), axis=1).T:
+			network_list.append([str(self.ko_ids[edge[0]]), str(self.compound_ids[edge[1]])])
+
+		return network_list
+
+	# Per-KO lists of input and output compound codes, with an empty list for each KO that could not be translated
+	def adjacency(self):
+
+		dictionaries = []
+		for ko_array, compound_array in [(self.input_ko, self.input_compound), (self.output_ko, self.output_compound)]:
+			ko_compound_dict = dict((ko, []) for ko in self.query_kos)
+			# A stable sort groups edges by KO without changing their order within each KO
+			order = numpy.argsort(ko_array, kind='stable')
+			boundaries = numpy.searchsorted(ko_array[order], numpy.arange(len(self.ko_ids) + 1))
+			for index, ko in enumerate(self.ko_ids):
+				ko_compound_dict[ko] = [str(x) for x in self.compound_ids[compound_array[order[boundaries[index]:boundaries[index + 1]]]]]
+			dictionaries.append(ko_compound_dict)
+
+		return dictionaries[0], dictionaries[1]
+
+	# Sparse substrate-by-KO incidence matrices for input and output edges, only compound codes starting with C are substrates
+	def incidence(self):
+
+		substrate_index = numpy.cumsum(self.substrate) - 1
+		substrate_lst = [str(x) for x in self.compound_ids[self.substrate]]
+
+		matrices = []
+		for ko_array, compound_array in [(self.input_ko, self.input_compound), (self.output_ko, self.output_compound)]:
+			keep = self.substrate[compound_array]
+			# Repeated edges are summed during conversion, same as the repeated additions in compile_transcripts
+			values = numpy.ones(int(keep.sum()))
+			matrix = scipy.sparse.coo_matrix((values, (substrate_index[compound_array[keep]], ko_array[keep])), shape=(len(substrate_lst), len(self.ko_ids))).tocsr()
+			matrices.append(matrix)
+
+		return substrate_lst, matrices[0], matrices[1]
+
+	# Indegree and outdegree of each substrate, in the order of the incidence matrix rows
+	def degrees(self):
+
+		substrate_index = numpy.cumsum(self.substrate) - 1
+		n_substrates = int(self.substrate.sum())
+		indegree = numpy.bincount(substrate_index[self.output_compound[self.substrate[self.output_compound]]], minlength=n_substrates)
+		outdegree = numpy.bincount(substrate_index[self.input_compound[self.substrate[self.input_compound]]], minlength=n_substrates)
+
+		return indegree, outdegree
+
+
+# Translates a list of KOs to the bipartite graph
+def network_graph(KOs, reference):
+
+	# Set some starting points
+	triedCountKO = 0
+	excludedCountKO = 0
+	triedCountReact = 0
+	excludedCountReact = 0
+	totalIncludedReact = 0
+
+	# Edges are collected as reference KO and compound indices, which are already integers in the store
+	query_kos = []
+	translated_kos = []
+	input_kos = []
+	input_compounds = []
+	output_kos = []
+	output_compounds = []
+
+	ko_ids = reference['ko_ids']
+	ko_indptr = reference['ko_indptr']
+	ko_reactions = reference['ko_reactions']
+	reaction_ids = reference['reaction_ids']
+	reaction_indptr = reference['reaction_indptr']
+	formula_input_indptr = reference['formula_input_indptr']
+	formula_inputs = reference['formula_inputs']
+	formula_output_indptr = reference['formula_output_indptr']
+	formula_outputs = reference['formula_outputs']
+	formula_reversible = reference['formula_reversible']
+	compound_ids = reference['compound_ids']
+
+	# Nested loops to convert the KO list to a directed graph of input and output compounds
+	# Outside loop finds the biochemical reactions corresponding the the given KO	
+	print('Translating KEGG orthologs to bipartite enzyme-to-compound graph...\n')
+	
+	# Reference errors are collected in memory and written out by the caller as key_error.log
+	errorfile = io.StringIO()
+
+	for current_ko in KOs:
+
+		triedCountKO += 1
+		query_kos.append(current_ko)
+		
+		# KO codes are sorted in the reference store, so a binary search replaces the dictionary lookup
+		ko_index = numpy.searchsorted(ko_ids, current_ko.encode('utf-8'))
+		if ko_index == len(ko_ids) or ko_ids[ko_index] != current_ko.encode('utf-8'):
+			errorString = 'WARNING: ' + str(current_ko) + ' not found in KO-to-Reaction dictionary. Omitting.\n'
+			errorfile.write(errorString)
+			excludedCountKO += 1
+			continue 
+
+		# Inner loop translates the reaction codes to collections of input and output compounds
+		for index in ko_reactions[ko_indptr[ko_index]:ko_indptr[ko_index + 1]]:
+			triedCountReact += 1
+			reaction_collection = range(reaction_indptr[index], reaction_indptr[index + 1])
+			if len(reaction_collection) == 0:
+				errorString = 'WARNING: ' + reaction_ids[index].decode('utf-8') + ' not found in Reaction-to-Compound dictionary. Omitting.\n'
+				errorfile.write(errorString)
+				excludedCountReact += 1
+				continue
+	
+			# The innermost loop creates input and output edges, incorporating reversibility information
+			translated_kos.append(ko_index)
+			for x in reaction_collection:
+			
+				totalIncludedReact += 1
+				
+				# Input and output compounds of each formula are already parsed into compound indices
+				formula_input = formula_inputs[formula_input_indptr[x]:formula_input_indptr[x + 1]]
+				formula_output = formula_outputs[formula_output_indptr[x]:formula_output_indptr[x + 1]]
+
+				# Reversible formulas also consume their products and produce their substrates
+				if formula_reversible[x]:
+					consumed = [formula_input, formula_output]
+					produced = [formula_input, formula_output]
+				else:
+					consumed = [formula_input]
+					produced = [formula_output]
+
+				for compounds in consumed:
+					input_kos.append(numpy.full(len(compounds), ko_index, dtype=numpy.int32))
+					input_compounds.append(compounds)
+				for compounds in produced:
+					output_kos.append(numpy.full(len(compounds), ko_index, dtype=numpy.int32))
+					output_compounds.append(compounds)
+							
+	error_string = '''KOs successfully translated to Reactions: {KO_success}
+KOs unsuccessfully translated to Reactions: {KO_failed}
+
+Reactions successfully translated to Compounds: {Reaction_success}
+Reactions unsuccessfully translated to Compounds: {Reaction_failed}
+'''.format(KO_success = str(triedCountKO - excludedCountKO), KO_failed = str(excludedCountKO), Reaction_success = str(triedCountReact - excludedCountReact), Reaction_failed = str(excludedCountReact))
+	errorfile.write(error_string)
+
+	# Reference indices are remapped to compact ranges, sorted so that seeded permutations are assigned to KOs in the same order on every run
+	empty = [numpy.zeros(0, dtype=numpy.int32)]
+	input_kos = numpy.concatenate(input_kos + empty)
+	input_compounds = numpy.concatenate(input_compounds + empty)
+	output_kos = numpy.concatenate(output_kos + empty)
+	output_compounds = numpy.concatenate(output_compounds + empty)
+
+	ko_lst, ko_index = numpy.unique(numpy.concatenate([numpy.array(translated_kos, dtype=numpy.int32), input_kos, output_kos]), return_inverse=True)
+	compound_lst, compound_index = numpy.unique(numpy.concatenate([input_compounds, output_compounds]), return_inverse=True)
+	n_translated = len(translated_kos)
+	n_input = len(input_kos)
+	n_input_compounds = len(input_compounds)
+
+	graph = Graph(ko_ids[ko_lst].astype(str), compound_ids[compound_lst].astype(str), query_kos, 
+		ko_index[n_translated:n_translated + n_input].astype(numpy.int32), compound_index[:n_input_compounds].astype(numpy.int32), 
+		ko_index[n_translated + n_input:].astype(numpy.int32), compound_index[n_input_compounds:].astype(numpy.int32))
+
+	key_errors = errorfile.getvalue()
+	errorfile.close()
+	print('Done.\n')
+	
+	return graph, key_errors
+
+
+# Translates a list of KOs to the bipartite graph as edge lists and per-KO compound lists
+def network_dictionaries(KOs, reference):
+
+	graph, key_errors = network_graph(KOs, reference)
+	ko_input_dict, ko_output_dict = graph.adjacency()
+
+	return graph.edge_list(), ko_input_dict, ko_output_dict, [str(x) for x in graph.compound_ids], [str(x) for x in graph.ko_ids], key_errors
+
+
+# Convert KO adjacency lists into sparse compound-by-KO incidence matrices for input and output edges
+def incidence_matrices(ko_input_dict, ko_output_dict, compound_lst, KO_lst):
+
+	substrate_lst = [x for x in compound_lst if x[0] == 'C']
+	substrate_index = dict((compound, index) for index, compound in enumerate(substrate_lst))
+
+	matrices = []
+	for ko_compound_dict in [ko_input_dict, ko_output_dict]:
+		rows = []
+		columns = []
+		for column, ko in enumerate(KO_lst):
+			for compound in ko_compound_dict[ko]:
+				if compound[0] != 'C': continue
+				rows.append(substrate_index[compound])
+				columns.append(column)
+
+		# Repeated edges are summed during conversion, same as the repeated additions in compile_transcripts
+		values = numpy.ones(len(rows))
+		matrix = scipy.sparse.coo_matrix((values, (rows, columns)), shape=(len(substrate_lst), len(KO_lst))).tocsr()
+		matrices.append(matrix)
+
+	return substrate_lst, matrices[0], matrices[1]
@@ -0,0 +1,338 @@
+'''Tab-delimited and binary output writers for bigSMALL results, into a directory or a single run archive'''
+
+import os
+import io
+import json
+import time
+import zipfile
+import contextlib
+import numpy
+
+#---------------------------------------------------------------------------------------#		
+
+# Open a path for writing, or pass through a handle that is already open and left for the caller to close
+def output_handle(file_name, mode='w'):
+
+	if isinstance(file_name, str):
+		return open(file_name, mode)
+	else:
+		return contextlib.nullcontext(file_name)
+
+
+# Function to write lists to files	
+def write_list(header, out_lst, file_name):
+
+	with output_handle(file_name) as out_file: 
+		
+		if not header == 'none': out_file.write(header)
+			
+		for index in out_lst:
+			index = [str(x) for x in index]
+			index[-1] = str(index[-1]) + '\n'
+			out_file.write('\t'.join(index))
+
+
+# Specialized version of previous function
+def write_list_short(header, out_lst, file_name):
+
+	with output_handle(file_name) as out_file: 
+		
+		if not header == 'none': out_file.write(header)
+			
+		for index in out_lst:
+			index = [str(x) for x in index]
+			index[-1] = str(index[-1]) + '\n'
+			out_file.write(''.join(index))
+
+			
+
+# Function to write dictionaries to files (next 2 functions are similar)	
+def write_dictionary(header, out_dict, file_name):
+
+	all_keys = list(set(out_dict.keys()))
+	
+	with output_handle(file_name) as out_file: 
+		
+		if not header == 'none': out_file.write(header)
+			
+		for index in all_keys:
+			elements = [index] + list(out_dict[index])
+			elements = [str(x) for x in elements]
+			elements[-1] = elements[-1] + '\n'
+			out_file.write('\t'.join(elements))
+
+
+def write_dictionary_short(header, out_dict, file_name):
+
+	all_keys = list(set(out_dict.keys()))
+	
+	with output_handle(file_name) as out_file: 
+		
+		if not header == 'none': out_file.write(header)
+			
+		for index in all_keys:
+			entry = index + '\t' + str(out_dict[index]) + '\n'
+			out_file.write(entry)
+
+
+def write_dictionary_list(header, out_dict, file_name):
+
+	all_keys = list(set(out_dict.keys()))
+	
+	with output_handle(file_name) as out_file: 
+		
+		if not header == 'none': out_file.write(header)
+			
+		for index in all_keys:
+			entry = index + '\t' + ','.join(out_dict[index]) + '\n'
+			out_file.write(entry)
+
+
+
+# Write (name, array) columns as one typed .npy table, with one field per column
+# Tables can be read back without parsing through numpy.load(file_name, mmap_mode='r')
+def write_table(columns, file_name):
+
+	n_rows = len(columns[0][1])
+	table = numpy.zeros(n_rows, dtype=[(name, array.dtype) for name, array in columns])
+	for name, array in columns:
+		table[name] = array
+
+	with output_handle(file_name, 'wb') as out_file:
+		numpy.save(out_file, table)
+
+
+# Write rows either as a tab-delimited file or as a typed .npy table
+# Columns holding any text are stored as unicode fields, all others as numbers
+def write_rows(header, out_lst, file_name, output_format='tsv'):
+
+	if output_format == 'tsv':
+		write_list('\t'.join(header) + '\n', out_lst, file_name)
+		return
+
+	columns = []
+	for index, name in enumerate(header):
+		values = [x[index] for x in out_lst]
+		if any([isinstance(x, str) for x in values]):
+			columns.append((name, numpy.array([str(x) for x in values], dtype=str)))
+		else:
+			columns.append((name, numpy.array(values, dtype=float if len(values) == 0 else None)))
+
+	write_table(columns, file_name)
+
+
+#---------------------------------------------------------------------------------------#		
+
+class OutputDirectory(object):
+	'''Directory that receives each output of a run as its own file'''
+
+	def __init__(self, directory):
+
+		self.location = directory
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+	def open(self, member, binary=False):
+
+		return open(os.path.join(self.location, member), 'wb' if binary else 'w')
+
+	def close(self):
+
+		pass
+
+
+class RunArchive(object):
+	'''Single uncompressed zip that receives every output of a run, indexed by a manifest.json member
+
+	Members are stored rather than deflated, so each .npy table lies contiguously in the file and 
+	read_archive_table can memory-map it in place. The manifest lists every member with its byte 
+	offset and size, and the dtype and row count of each table.
+	'''
+
+	def __init__(self, file_name):
+
+		self.location = file_name
+		self.zip_file = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_STORED, allowZip64=True)
+
+	def open(self, member, binary=False):
+
+		info = zipfile.ZipInfo(member, time.localtime(time.time())[:6])
+		info.compress_type = zipfile.ZIP_STORED
+		handle = self.zip_file.open(info, 'w', force_zip64=True)
+		if binary: return handle
+		return io.TextIOWrapper(handle, encoding='utf-8', newline='')
+
+	# Index the members written so far and append the manifest
+	def close(self):
+
+		self.zip_file.close()
+
+		manifest = {'format': 'bigsmall-archive', 'version': 1, 'members': {}}
+		with zipfile.ZipFile(self.location, 'r') as zip_file:
+			for info in zip_file.infolist():
+				entry = {'offset': archive_offset(self.location, info), 'size': info.file_size}
+				if info.filename.endswith('.npy'):
+					dtype, shape, data_offset = archive_table_header(self.location, info)
+					entry['columns'] = list(dtype.names)
+					entry['rows'] = shape[0]
+				manifest['members'][info.filename] = entry
+
+		with zipfile.ZipFile(self.location, 'a', zipfile.ZIP_STORED) as zip_file:
+			zip_file.writestr('manifest.json', json.dumps(manifest, indent=1, sort_keys=True))
+
+
+# Byte offset of a stored member's data, found after its local file header
+def archive_offset(archive_name, info):
+
+	with open(archive_name, 'rb') as archive_file:
+		archive_file.seek(info.header_offset)
+		local_header = archive_file.read(30)
+
+	name_length = int.from_bytes(local_header[26:28], 'little')
+	extra_length = int.from_bytes(local_header[28:30], 'little')
+
+	return info.header_offset + 30 + name_length + extra_length
+
+
+# Dtype and shape of a stored .npy member, with the offset of its array data
+def archive_table_header(archive_name, info):
+
+	with open(archive_name, 'rb') as archive_file:
+		archive_file.seek(archive_offset(archive_name, info))
+		version = numpy.lib.format.read_magic(archive_file)
+		if version == (1, 0):
+			shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(archive_file)
+		else:
+			shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(archive_file)
+		data_offset = archive_file.tell()
+
+	return dtype, shape, data_offset
+
+
+# Memory-map one .npy table of a run archive without extracting or copying it
+def read_archive_table(archive_name, member):
+
+	with zipfile.ZipFile(archive_name, 'r') as zip_file:
+		info = zip_file.getinfo(member)
+	dtype, shape, data_offset = archive_table_header(archive_name, info)
+	# Empty tables cannot be mapped
+	if numpy.prod(shape) == 0: return numpy.zeros(shape, dtype=dtype)
+
+	return numpy.memmap(archive_name, dtype=dtype, mode='r', offset=data_offset, shape=shape)
+
+
+# Read one text member of a run archive
+def read_archive_text(archive_name, member):
+
+	with zipfile.ZipFile(archive_name, 'r') as zip_file:
+		return zip_file.read(member).decode('utf-8')
+
+
+class InteractionTable(object):
+	'''Long-format table of interactions for many pairs, streamed one pair at a time with a byte index of each pair
+
+	A companion <name>.index.tsv lists each pair with the byte offset, length and row count of its lines, so a
+	single pair can be read by seeking rather than scanning. Pairs from an earlier table are copied across by 
+	byte range without parsing, which lets a community's table grow as species are added while staying in order.
+	Pairs that belong further down the table can be held in a spill file per leading row until the table reaches 
+	it, so only their byte counts stay in memory.
+	'''
+
+	def __init__(self, file_name, header, previous=None):
+
+		self.location = file_name
+		self.out_file = open(file_name, 'wb')
+		self.out_file.write(header.encode('utf-8'))
+		self.index = []
+		self.previous = previous
+		self.previous_index = read_table_index(previous) if previous is not None else []
+		self.previous_leading = set([x[0] for x in self.previous_index])
+		self.copied = 0
+		self.held = {}
+
+	# Write one pair's lines at the end of the table
+	def add(self, species_1, species_2, lines):
+
+		data = ''.join(lines).encode('utf-8')
+		self.index.append([species_1, species_2, self.out_file.tell(), len(data), len(lines)])
+		self.out_file.write(data)
+
+	# Hold one pair's lines in the spill file of the given leading row, to be added in their order by release
+	def hold(self, lead, species_1, species_2, lines):
+
+		data = ''.join(lines).encode('utf-8')
+		with open(self.spill_name(lead), 'ab') as spill_file:
+			spill_file.write(data)
+		self.held.setdefault(lead, []).append([species_1, species_2, len(data), len(lines)])
+
+	# Add the pairs held for leading rows up to the given one, or all that remain, removing their spill files
+	def release(self, lead=None):
+
+		for held_lead in sorted([x for x in self.held.keys() if lead is None or x <= lead]):
+			with open(self.spill_name(held_lead), 'rb') as spill_file:
+				for species_1, species_2, size, rows in self.held.pop(held_lead):
+					self.index.append([species_1, species_2, self.out_file.tell(), size, rows])
+					self.out_file.write(spill_file.read(size))
+			os.remove(self.spill_name(held_lead))
+
+	def spill_name(self, lead):
+
+		return self.location + '.' + str(lead) + '.spill'
+
+	# Copy pairs of the earlier table across in their order, through those led by species_1, or all that remain
+	def copy(self, species_1=None):
+
+		if self.previous is None: return
+		if species_1 is not None and not species_1 in self.previous_leading: return
+
+		with open(self.previous, 'rb') as previous_file:
+			reached = False
+			while self.copied < len(self.previous_index):
+				entry = self.previous_index[self.copied]
+				if reached and entry[0] != species_1: break
+				reached = entry[0] == species_1
+				previous_file.seek(entry[2])
+				self.index.append([entry[0], entry[1], self.out_file.tell(), entry[3], entry[4]])
+				self.out_file.write(previous_file.read(entry[3]))
+				self.copied += 1
+
+	def close(self):
+
+		self.copy()
+		self.release()
+		self.out_file.close()
+		with open(table_index_name(self.location), 'w') as index_file:
+			index_file.write('species_1\tspecies_2\toffset\tbytes\trows\n')
+			for entry in self.index:
+				index_file.write('\t'.join([str(x) for x in entry]) + '\n')
+
+
+# Name of the index that accompanies a long-format table
+def table_index_name(file_name):
+
+	return os.path.splitext(file_name)[0] + '.index.tsv'
+
+
+# Read the index of a long-format table as [species_1, species_2, offset, bytes, rows] entries in table order
+def read_table_index(file_name):
+
+	index = []
+	with open(table_index_name(file_name), 'r') as index_file:
+		for line in index_file:
+			line = line.rstrip('\n').split('\t')
+			if line[0] == 'species_1': continue
+			index.append([line[0], line[1], int(line[2]), int(line[3]), int(line[4])])
+
+	return index
+
+
+# Read the lines of one pair from a long-format table by seeking to them through its index
+def read_table_pair(file_name, species_1, species_2):
+
+	for entry in read_table_index(file_name):
+		if entry[0] == species_1 and entry[1] == species_2:
+			with open(file_name, 'rb') as table_file:
+				table_file.seek(entry[2])
+				return table_file.read(entry[3]).decode('utf-8').splitlines(True)
+
+	return []
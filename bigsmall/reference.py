@@ -0,0 +1,51 @@
+'''KEGG reference store access for bigSMALL'''
+
+import os
+import hashlib
+import numpy
+
+#---------------------------------------------------------------------------------------#		
+
+# Default location of the reference store written by support/create_network_refs.py
+default_reference = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'support', 'kegg_reference')
+
+#---------------------------------------------------------------------------------------#		
+
+# Memory-map the pre-parsed KEGG reference store created by support/create_network_refs.py
+# Pages are only read when touched and are shared through the page cache by every process on the host
+def load_reference(store_directory=default_reference):
+
+	reference = {}
+	for store_file in os.listdir(store_directory):
+		if not store_file.endswith('.npy'): continue
+		reference[store_file[:-4]] = numpy.load(os.path.join(store_directory, store_file), mmap_mode='r')
+
+	return reference
+
+
+# Look up names for only the compounds in the current network
+def compound_names(reference, compound_lst):
+
+	compound_ids = reference['compound_ids']
+	name_indptr = reference['compound_name_indptr']
+	names = reference['compound_names']
+
+	compound_name_dict = {}
+	for compound in compound_lst:
+		index = numpy.searchsorted(compound_ids, compound.encode('utf-8'))
+		if index == len(compound_ids) or compound_ids[index] != compound.encode('utf-8'): continue
+		compound_name_dict[compound] = names[name_indptr[index]:name_indptr[index + 1]].tobytes().decode('utf-8')
+
+	return compound_name_dict
+
+
+# Hash of every array in a reference store, so results built from it can be tied to its exact contents
+def reference_version(reference):
+
+	digest = hashlib.blake2b(digest_size=16)
+	for name in sorted(reference.keys()):
+		array = numpy.ascontiguousarray(reference[name])
+		digest.update((name + str(array.dtype) + str(array.shape)).encode('utf-8'))
+		digest.update(array.tobytes())
+
+	return digest.hexdigest()
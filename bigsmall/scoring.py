@@ -0,0 +1,489 @@
+'''Importance scores and permutation-based significance for compound nodes'''
+
+import sys
+import math
+import hashlib
+import functools
+import concurrent.futures
+import numpy
+import scipy.stats
+
+from .network import incidence_matrices
+from .cache import null_key
+
+#---------------------------------------------------------------------------------------#		
+
+# Calculates mean and confidence intervals at the desired level for a given distribution
+def calc_confidence(raw_distribution, confidence):
+    raw_array = 1.0 * numpy.array(raw_distribution)
+    array_length = len(raw_array)
+    array_mean = numpy.mean(raw_array), 
+    array_standarderror = scipy.stats.sem(raw_array)
+    array_confidence = array_standarderror * scipy.stats.t._ppf((1 + confidence) / 2., array_length - 1)
+    return array_mean, array_mean - array_confidence, array_mean + array_confidence
+
+
+# Importance scores of every compound for a KO expression vector, or for each column of a KO-by-sample matrix
+# Scores are returned unrounded with the shape of the expression, together with the indegree and outdegree of each compound
+def importance_scores(input_matrix, output_matrix, expression):
+
+	outdegree = numpy.asarray(input_matrix.sum(axis=1)).ravel()
+	indegree = numpy.asarray(output_matrix.sum(axis=1)).ravel()
+
+	expression = numpy.asarray(expression, dtype=float)
+	input_transcription = input_matrix.dot(expression)
+	output_transcription = output_matrix.dot(expression)
+
+	return transcription_scores(input_transcription, output_transcription, indegree, outdegree), indegree, outdegree
+
+
+# Importance scores from the summed input and output transcription of each compound, one row per compound
+def transcription_scores(input_transcription, output_transcription, indegree, outdegree):
+
+	# Compounds without adjacent enzymes in a direction have no transcription to divide, so they stay at 0
+	input_divisor = numpy.maximum(outdegree, 1.0)
+	output_divisor = numpy.maximum(indegree, 1.0)
+	if numpy.ndim(input_transcription) == 2:
+		input_divisor = input_divisor[:, numpy.newaxis]
+		output_divisor = output_divisor[:, numpy.newaxis]
+	score_difference = input_transcription / input_divisor - output_transcription / output_divisor
+
+	# Signed log transform of the difference between input and output transcription per edge
+	return numpy.sign(score_difference) * numpy.log2(numpy.abs(score_difference) + 1.0)
+
+
+# Split permutations into fixed-size blocks, each with its own random stream spawned from one seed
+# Streams belong to blocks rather than processes, so results do not depend on how many workers are used
+def block_seeds(seed, iterations, block_size=1000):
+
+	if not isinstance(seed, numpy.random.SeedSequence):
+		seed = numpy.random.SeedSequence(seed)
+
+	block_sizes = [min(block_size, iterations - x) for x in range(0, iterations, block_size)]
+
+	return list(zip(block_sizes, seed.spawn(len(block_sizes))))
+
+
+# Generate one KO-by-permutation block of shuffled transcript distributions
+def permutation_block(transcript_array, block_size, block_seed):
+
+	# Each row is shuffled independently, so rows are permutations of the same transcript multiset
+	generator = numpy.random.default_rng(block_seed)
+	block = numpy.tile(transcript_array, (block_size, 1))
+	block = generator.permuted(block, axis=1)
+
+	return block.T
+
+
+# Permute and score one block, optionally returning a 64-bit digest of each permutation for duplicate rejection
+# With rows, only those compounds are scored, since each compound's score depends only on its own incidence row
+# Kept at module level so it can be sent to worker processes
+def score_permutation_block(input_matrix, output_matrix, transcript_array, unique, block_size, block_seed, rows=None):
+
+	block = permutation_block(transcript_array, block_size, block_seed)
+	if rows is not None:
+		input_matrix = input_matrix[rows]
+		output_matrix = output_matrix[rows]
+	block_scores = importance_scores(input_matrix, output_matrix, block)[0]
+
+	digests = None
+	if unique:
+		digests = [hashlib.blake2b(block[:, x].tobytes(), digest_size=8).digest() for x in range(block.shape[1])]
+
+	return block_scores, digests
+
+
+class NullDistribution(object):
+	'''Permuted importance scores of each compound, kept exactly as float32 or as a fixed-width histogram
+
+	With a resolution, memory no longer grows with the number of permutations and every
+	order statistic is reported as a bin centre within resolution / 2 of the exact value.
+	Compounds can stop receiving permutations early, so counts holds how many each one has 
+	and count the most of any compound.
+	'''
+
+	def __init__(self, n_compounds, iterations, resolution=None, score_limit=64.0):
+
+		self.count = 0
+		self.counts = numpy.zeros(n_compounds, dtype=int)
+		self.resolution = resolution
+		self.score_limit = score_limit
+		if resolution is None:
+			self.scores = numpy.empty((n_compounds, iterations), dtype=numpy.float32)
+		else:
+			n_bins = int(math.ceil(2.0 * score_limit / resolution)) + 1
+			self.histogram = numpy.zeros((n_compounds, n_bins), dtype=numpy.int32)
+
+	# Add a compound-by-permutation block of scores, for every compound or only the given rows
+	# Rows must be compounds that have received every permutation so far, as a compound that stops never resumes
+	def update(self, block_scores, rows=None):
+
+		if rows is None:
+			rows = numpy.arange(len(self.counts))
+		if self.resolution is None:
+			self.scores[rows, self.count:self.count + block_scores.shape[1]] = block_scores
+		else:
+			bins = numpy.rint((block_scores + self.score_limit) / self.resolution).astype(numpy.int64)
+			bins = numpy.clip(bins, 0, self.histogram.shape[1] - 1)
+			# Offset each compound's bins into one flat range and count only the bins the block touches,
+			#	so no transient array is larger than the block itself
+			bins += numpy.asarray(rows)[:, numpy.newaxis] * self.histogram.shape[1]
+			touched, counts = numpy.unique(bins.ravel(), return_counts=True)
+			self.histogram.reshape(-1)[touched] += counts.astype(numpy.int32)
+
+		self.counts[rows] += block_scores.shape[1]
+		self.count = int(self.counts.max(initial=0))
+
+	# Arrays holding the permutations added so far, in the form stored by a Cache
+	def arrays(self):
+
+		arrays = {'count': numpy.array(self.count), 'counts': self.counts, 'score_limit': numpy.array(self.score_limit)}
+		if self.resolution is None:
+			arrays['scores'] = self.scores[:, :self.count]
+		else:
+			arrays['histogram'] = self.histogram
+			arrays['resolution'] = numpy.array(self.resolution)
+
+		return arrays
+
+	# Rebuild a null distribution from the arrays of a Cache entry
+	@classmethod
+	def from_arrays(cls, arrays):
+
+		if 'scores' in arrays:
+			null_distribution = cls(arrays['scores'].shape[0], 0, None, float(arrays['score_limit']))
+			null_distribution.scores = arrays['scores']
+		else:
+			null_distribution = cls(arrays['histogram'].shape[0], 0, float(arrays['resolution']), float(arrays['score_limit']))
+			null_distribution.histogram = arrays['histogram']
+		null_distribution.count = int(arrays['count'])
+		null_distribution.counts = numpy.array(arrays['counts']) if 'counts' in arrays else numpy.full(len(null_distribution.counts), null_distribution.count)
+
+		return null_distribution
+
+	# Score at each 0-based rank of the sorted permutations, one column per rank, for every compound or only the given rows
+	# Ranks are shared, so the rows should all have received the same number of permutations
+	def order_statistics(self, ranks, rows=None):
+
+		if self.resolution is None:
+			if rows is None:
+				# Partitioning in place is safe because the order of permutations carries no information
+				scores = self.scores[:, :self.count]
+			else:
+				scores = self.scores[rows, :self.counts[rows[0]]]
+			scores.partition(ranks, axis=1)
+			return scores[:, ranks].astype(float)
+
+		histogram = self.histogram if rows is None else self.histogram[rows]
+		cumulative = numpy.cumsum(histogram, axis=1)
+		bins = numpy.array([numpy.argmax(cumulative > rank, axis=1) for rank in ranks]).T
+
+		return bins * self.resolution - self.score_limit
+
+	# Number of permuted scores at or above and at or below each compound's observed score, 
+	#	counting anything within tolerance of it as a tie, the tolerance can be one value or one per compound
+	def tail_counts(self, observed, tolerance=0.0):
+
+		observed = numpy.asarray(observed, dtype=float)[:, numpy.newaxis]
+		tolerance = numpy.reshape(tolerance, (-1, 1))
+		if self.resolution is None:
+			scores = self.scores[:, :self.count]
+			# Compounds that stopped early leave unwritten scores beyond their own count
+			scored = numpy.arange(self.count) < self.counts[:, numpy.newaxis]
+			return ((scores >= observed - tolerance) & scored).sum(axis=1), ((scores <= observed + tolerance) & scored).sum(axis=1)
+
+		# Histogram bins are compared by their centres, so ties extend to half a bin width
+		tolerance = numpy.maximum(tolerance, self.resolution / 2.0)
+		centres = numpy.arange(self.histogram.shape[1]) * self.resolution - self.score_limit
+		upper = numpy.where(centres >= observed - tolerance, self.histogram, 0).sum(axis=1)
+		lower = numpy.where(centres <= observed + tolerance, self.histogram, 0).sum(axis=1)
+
+		return upper, lower
+
+
+# Distance within which a permuted score counts as a tie with each observed score
+# Permuted scores are summed in a different order and stored as float32, so a small tolerance keeps exact ties
+def tie_tolerance(observed):
+
+	return 1e-6 * (1.0 + numpy.abs(observed))
+
+
+# Two-sided empirical p-values of every compound's observed score against its own permuted scores
+def empirical_pvalues(null_distribution, observed):
+
+	observed = numpy.asarray(observed, dtype=numpy.float32)
+	upper, lower = null_distribution.tail_counts(observed, tie_tolerance(observed))
+	tail = numpy.minimum(upper, lower) + 1.0
+	p_values = 2.0 * tail / (null_distribution.counts + 1.0)
+
+	return numpy.minimum(p_values, 1.0)
+
+
+# Benjamini-Hochberg q-values for an array of p-values, returned in the same order
+def benjamini_hochberg(p_values):
+
+	p_values = numpy.asarray(p_values, dtype=float)
+	n = len(p_values)
+	if n == 0: return p_values
+
+	order = numpy.argsort(p_values)
+	ranked = p_values[order] * n / numpy.arange(1, n + 1)
+	# Running minimum from the largest p-value down keeps q-values monotone in p
+	ranked = numpy.minimum.accumulate(ranked[::-1])[::-1]
+	q_values = numpy.empty(n)
+	q_values[order] = numpy.minimum(ranked, 1.0)
+
+	return q_values
+
+
+# Ranks of the lower and upper bounds of the widened median interval for n permutations
+# Bonett DG & Price RM. (2002). Statistical inference for a linear function of medians: confidence intervals, 
+#	hypothesis testing, and sample size requirements. Psychol Methods. 7(3):370-83.
+def interval_ranks(n, m):
+
+	q = 0.5
+	nq = n * q
+	current_range = m * math.sqrt(n * q * (1 - q))
+	j = int(math.ceil(nq - current_range) - 1)
+	k = int(math.ceil(nq + current_range) - 1)
+
+	return j, k
+
+
+# Lower bound, median and upper bound of the permuted scores of every compound
+def null_intervals(null_distribution, m):
+
+	# Compounds with the same number of permutations share their order statistics' ranks, 
+	#	which is every compound unless some stopped early
+	counts = null_distribution.counts
+	statistics = numpy.empty((len(counts), 4))
+	for n in numpy.unique(counts).tolist():
+		j, k = interval_ranks(n, m)
+		rows = None if numpy.all(counts == n) else numpy.flatnonzero(counts == n)
+		# The median is the mean of the two middle order statistics, as in numpy.median
+		statistics[slice(None) if rows is None else rows] = null_distribution.order_statistics([j, (n - 1) // 2, n // 2, k], rows)
+
+	return statistics[:, 0], (statistics[:, 1] + statistics[:, 2]) / 2.0, statistics[:, 3]
+
+
+# Score blocks in rounds of one block per worker, each scored only for the compounds still active when its round starts
+# Yields the rows each block was scored for with its scores and digests, later rounds skip compounds settled meanwhile
+def active_blocks(score_block, blocks, active, executor=None, round_size=1):
+
+	for start in range(0, len(blocks), round_size):
+		rows = numpy.flatnonzero(active)
+		if len(rows) == 0: return
+		round_blocks = blocks[start:start + round_size]
+		arguments = ([x[0] for x in round_blocks], [x[1] for x in round_blocks], [rows] * len(round_blocks))
+		scored = map(score_block, *arguments) if executor is None else executor.map(score_block, *arguments)
+		for block_scores, block_digests in scored:
+			yield rows, block_scores, block_digests
+
+
+# Permute the transcript distribution over the graph and collect the scores of every compound
+# With adaptive > 0, each compound stops receiving permutations once that many of its permuted scores are as extreme as 
+#	its observed score in the nearer tail, checked every 100 permutations with iterations as the maximum budget
+# Besag J & Clifford P. (1991). Sequential Monte Carlo p-values. Biometrika. 78(2):301-4.
+def permutation_null(incidence, transcript_array, iterations, seed=None, unique=False, workers=1, resolution=None, adaptive=0, observed=None, m=1.0):
+
+	substrate_lst, input_matrix, output_matrix = incidence
+
+	# Score each block of permutations with one sparse-dense product, spreading blocks across worker processes if requested
+	print('Permuting transcript distributions and calculating importance scores...\n')
+	progress = 0.0
+	sys.stdout.write('\rProgress: ' + str(progress) + '%')
+	sys.stdout.flush() 
+	# Adaptive runs check after smaller blocks, so compounds stop close to where their tail counts are reached
+	blocks = block_seeds(seed, iterations, 100 if adaptive > 0 else 1000)
+	score_block = functools.partial(score_permutation_block, input_matrix, output_matrix, transcript_array, unique)
+
+	executor = None
+	if workers > 1:
+		executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+	if adaptive > 0:
+		active = numpy.ones(len(substrate_lst), dtype=bool)
+		scored_blocks = active_blocks(score_block, blocks, active, executor, workers)
+		observed = numpy.asarray(observed, dtype=numpy.float32)
+		tolerance = tie_tolerance(observed)
+		upper = numpy.zeros(len(substrate_lst), dtype=int)
+		lower = numpy.zeros(len(substrate_lst), dtype=int)
+	else:
+		block_sizes = [x[0] for x in blocks]
+		if executor is not None:
+			scored_blocks = executor.map(score_block, block_sizes, [x[1] for x in blocks])
+		else:
+			scored_blocks = map(score_block, block_sizes, [x[1] for x in blocks])
+		scored_blocks = ((None, block_scores, block_digests) for block_scores, block_digests in scored_blocks)
+
+	# Scores cannot exceed the log transform of the largest transcript count, which bounds the histogram
+	score_limit = math.log(max([abs(x) for x in transcript_array] + [0]) + 1, 2) + 1.0
+	# A whole number of bins below 0 makes 0 a bin centre, so nulls of exactly 0 are reported as 0
+	if resolution is not None:
+		score_limit = math.ceil(score_limit / resolution) * resolution
+	null_distribution = NullDistribution(len(substrate_lst), iterations, resolution, score_limit)
+
+	# Blocks are merged and checked in order, so duplicate rejection and early stopping 
+	#	keep the same permutations for any number of workers
+	attempts = 0
+	digests = set()
+	for rows, block_scores, block_digests in scored_blocks:
+		attempts += block_scores.shape[1]
+		if unique:
+			keep = []
+			for index, digest in enumerate(block_digests):
+				if not digest in digests:
+					digests.add(digest)
+					keep.append(index)
+			block_scores = block_scores[:, keep]
+
+		# A block can be scored for compounds that settled while it was in flight, only those still active are kept
+		if adaptive > 0:
+			still_active = active[rows]
+			rows = rows[still_active]
+			block_scores = block_scores[still_active]
+
+		null_distribution.update(block_scores, rows)
+
+		progress = float("%.3f" % (100.0 * attempts / iterations))
+		sys.stdout.write('\rProgress: ' + str(progress) + '%')
+		sys.stdout.flush() 
+
+		# A compound settles once either tail holds adaptive permuted scores, but not before its interval fits inside them
+		if adaptive > 0:
+			upper[rows] += (block_scores >= (observed - tolerance)[rows, numpy.newaxis]).sum(axis=1)
+			lower[rows] += (block_scores <= (observed + tolerance)[rows, numpy.newaxis]).sum(axis=1)
+			j, k = interval_ranks(null_distribution.count, m)
+			if j < 0 or k >= null_distribution.count: continue
+
+			active[rows[numpy.minimum(upper[rows], lower[rows]) >= adaptive]] = False
+			if not active.any(): break
+
+	if executor is not None:
+		executor.shutdown(cancel_futures=True)
+
+	sys.stdout.write('\rDone.                       \n\n')
+	if adaptive > 0:
+		settled = int((~active).sum())
+		if settled > 0:
+			print('Stopped permuting ' + str(settled) + ' of ' + str(len(substrate_lst)) + ' compounds early, after ' + str(int(null_distribution.counts.sum())) + ' of ' + str(len(substrate_lst) * iterations) + ' compound permutations.\n')
+
+	return null_distribution
+
+
+# Perform iterative simulation to create confidence interval for compound importance values
+# Incidence matrices already built for the same graph can be passed in to skip rebuilding them
+# A resolution keeps permuted scores as a bounded-memory histogram rather than every value
+# With the observed score_dict, two-sided empirical p-values are also returned in the order of interval_lst
+# With adaptive > 0 and the observed score_dict, each compound stops receiving permutations once that many of its 
+#	permuted scores are as extreme as observed; its p-value stays 2 * (tail + 1) / (n + 1) over the n permutations it received,
+#	slightly above the Besag-Clifford estimate h / n for compounds that stopped
+# With a Cache and a seed, the permuted scores are stored and reused by any later run of the same graph, 
+#	transcript multiset and permutation settings
+def probability_distribution(ko_input_dict, ko_output_dict, degree_dict, kos, compound_name_dict, seq_total, seq_max, compound_lst, transcription_dict, iterations, seed=None, unique=False, incidence=None, workers=1, resolution=None, adaptive=0, score_dict=None, cache=None):
+	
+	# Screen transcript distribution for those KOs included in the metabolic network
+	transcript_distribution = []
+	for index in kos:
+		transcript_distribution.append(int(transcription_dict[index]))
+	# Permutations start from the sorted multiset, so they depend only on which values are shuffled and not on their order
+	transcript_array = numpy.sort(numpy.asarray(transcript_distribution, dtype=float))
+
+	if incidence is None:
+		incidence = incidence_matrices(ko_input_dict, ko_output_dict, compound_lst, kos)
+	substrate_lst = incidence[0]
+
+	m = len(compound_lst) * 0.033 # Calculate foactor to expand confidence interval by
+	 # Needed to make a much more strict cutoff due to the random nature of the distributions
+
+	observed = None
+	if score_dict is not None:
+		observed = numpy.array([score_dict[x][1] for x in substrate_lst], dtype=float)
+
+	# Unseeded permutations cannot be repeated, so only seeded nulls are cached
+	null_distribution = None
+	key = None
+	if cache is not None and seed is not None:
+		key = null_key(incidence, transcript_array, iterations, seed, unique, resolution, adaptive, observed if adaptive > 0 else None)
+		entry = cache.load('null', key)
+		if entry is not None:
+			print('Loaded permuted importance scores from cache.\n')
+			null_distribution = NullDistribution.from_arrays(entry)
+
+	if null_distribution is None:
+		null_distribution = permutation_null(incidence, transcript_array, iterations, seed, unique, workers, resolution, adaptive, observed, m)
+		if key is not None:
+			cache.save('null', key, null_distribution.arrays())
+
+	print('Calculating summary statistics of each importance score distribution...\n')
+	# Tail counts do not depend on order, so they are taken before the interval partitions the scores
+	p_values = None
+	if score_dict is not None:
+		p_values = empirical_pvalues(null_distribution, observed)
+	lower, median, upper = null_intervals(null_distribution, m)
+
+	interval_lst = []
+	for index, compound in enumerate(substrate_lst):
+		# Rounded alike, so the median never falls outside its own bounds
+		lower_95 = round(float(lower[index]), 3)
+		current_median = round(float(median[index]), 3)
+		upper_95 = round(float(upper[index]), 3)
+		interval_lst.append([compound, lower_95, current_median, upper_95])
+
+	print('Done.\n')
+	return interval_lst, p_values, null_distribution.counts
+
+
+# Compare randomized confidence intervals and format final data structures
+# With empirical p-values, each entry carries its p-value and Benjamini-Hochberg q-value in place of the interval label
+def confidence_interval(score_dict, interval_lst, degree_dict, p_values=None):
+
+	if p_values is not None:
+		q_values = benjamini_hochberg(p_values)
+
+	labeled_confidence = []
+	sig_count = 0
+
+	for index in interval_lst:
+		
+		current_compound = index[0]
+		current_name = score_dict[current_compound][0]
+		current_indegree = degree_dict[current_compound][1]
+		current_outdegree = degree_dict[current_compound][2]
+		current_score = float(score_dict[current_compound][1])
+		
+		current_median = float(index[2])
+		current_simlower_95conf = float(index[1])
+		current_simupper_95conf = float(index[3])
+		
+		if current_score > current_median:
+			current_relationship = 'above'
+		elif current_score < current_median:
+			current_relationship = 'below'
+		else:
+			current_relationship = 'none'
+
+		if current_score > current_simupper_95conf:
+			current_sig = '<0.05'
+			sig_count += 1
+		elif current_score < current_simlower_95conf:
+			current_sig = '<0.05'
+			sig_count += 1
+		else:
+			current_sig = 'n.s.'
+
+		# Empirical p-values replace the interval label when they are available
+		if p_values is not None:
+			position = len(labeled_confidence)
+			labeled_confidence.append([current_compound, current_name, round(current_score, 3), round(float(p_values[position]), 6), round(float(q_values[position]), 6)])
+		else:
+			labeled_confidence.append([current_compound, current_name, round(current_score, 3), current_sig])	
+
+	# With p-values the count follows the reported columns rather than the interval
+	if p_values is not None:
+		sig_count = int((numpy.asarray(p_values) < 0.05).sum())
+		print('Detected significance for ' + str(sig_count) + ' of ' + str(len(interval_lst)) + ' total metabolites (p < 0.05), ' + str(int((q_values < 0.05).sum())) + ' after Benjamini-Hochberg correction (q < 0.05).\n')
+	else:
+		print('Detected significance for ' + str(sig_count) + ' of ' + str(len(interval_lst)) + ' total metabolites.\n')
+
+	return labeled_confidence
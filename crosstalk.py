@@ -1,308 +1,357 @@
-#!/usr/bin/env python
-'''USAGE: python crosstalk.py interaction.files --p n.s. --norm n
-Multi-level inference of substrate competition and cooperation between transcriptome-informed genome-scale models
-Calculates putative community-level and pair-wise metabolic interactions between species from aggregated bigSMALL analysis
-'''
-
-# Initialize all modules, functions, and compound dictionary
-import sys
-import numpy
-import os
-import argparse
-
-#---------------------------------------------------------------------------------------#
-
-# Find the directory where interaction.py is being run from
-script_path = str(os.path.dirname(os.path.realpath(__file__)))
-
-# Create a string with the name of the initial directory you start running the script from
-starting_directory = str(os.getcwd())
-
-#---------------------------------------------------------------------------------------#
-
-# Set up arguments
-parser = argparse.ArgumentParser(description='Calculate metabolic pair-wise and community-level interactions of species from the output of bigSMALL.')
-parser.add_argument('input_file')
-parser.add_argument('--p', default='n.s.', help='Minimum p-value for metabolites to be considered in calculations')
-parser.add_argument('--norm', default='n', help='Normalize each metabolic model to total transcript recruited to each (y or n)')
-
-args = parser.parse_args()
-interactions = args.input_file
-p_value = args.p
-normalize = args.norm
-
-if os.stat(interactions).st_size == 0 : sys.exit('WARNING: Input file empty, quitting')
-if p_value != 'n.s.' and p_value < 0.0: sys.exit('WARNING: Invalid p-value cutoff, quitting')
-if normalize != 'n' and normalize != 'y': sys.exit('WARNING: Invalid normalization response, quitting')
-
-print('\n')
-
-#---------------------------------------------------------------------------------------#
-
-# Define functions
-
-# Function to read in all species cominations from interaction file
-def read_files(files):
-
-	community = []
-	for line in files:
-		species = line.strip()
-		if os.path.exists(species) == False:
-			print('WARNING: ' + species + ' does not exist. Omitting combination.')
-			continue
-		community.append(species)
-
-	interactions = []
-	for index1 in community:
-		for index2 in community:
-			if index1 == index2:
-				continue
-			else:
-				interactions.append([index1, index2])
-
-	return interactions
-
-
-# Reads importance files, applying p-value filter, normalizes score to reads, and generates a dictionary for compound names and compound scores
-def read_scores(importance_scores, p_cutoff, norm):
-
-	score_dictionary = {}
-	name_dictionary = {}
-
-	for line in importance_scores:
-		
-		line = line.split()
-		if line[0] == 'Compound_code': continue
-		
-		compound_code = str(line[0])
-		compound_name = str(line[1])
-		
-		score = float(line[2])
-		if score == 0.0: continue
-		
-		p_value = str(line[3]).lstrip('<')
-		if p_value == 'n.s.': p_value = 1
-		p_value = float(p_value)
-		if p_value > p_cutoff: continue
-
-		score_dictionary[compound_code] = score
-		name_dictionary[compound_code] = compound_name	
-
-	if norm == 'y':
-		final_score_dictionary = {}
-		score_sum = sum([abs(x) for x in score_dictionary.values()])
-		for index in score_dictionary.keys():
-			final_score = score_dictionary[index] / score_sum
-			final_score_dictionary[index] = [name_dictionary[index], final_score]
-	else:
-		final_score_dictionary = {}
-		for index in score_dictionary.keys():
-			final_score_dictionary[index] = [name_dictionary[index], score_dictionary[index]]
-	
-	return final_score_dictionary
-
-
-# Function for calculating edges of metabolic competition
-def single_interaction(score_dict_1, score_dict_2):
-	
-	all_compounds = list(set(score_dict_1.keys() + score_dict_2.keys()))
-	
-	interaction_dictionary = {}
-	for index in all_compounds:
-
-		# Consider only those compounds in the network of both organisms
-		try:
-			score_1 = float(score_dict_1[index][1])
-			name = str(score_dict_1[index][0])
-		except KeyError:
-			continue
-		try:
-			score_2 = float(score_dict_2[index][1])
-		except KeyError:
-			continue
-
-		# Determine type and strength of interaction
-		if score_1 < 0 and score_2 < 0:
-			ratio = 0.0
-			magnitude = 0.0
-			interaction = 0.0
-		elif score_1 < 0 or score_2 < 0:
-			temp_score_1 = 2**abs(score_1)
-			temp_score_2 = 2**abs(score_2)
-			ratio = min([(temp_score_1 / temp_score_2), (temp_score_2 / temp_score_1)])
-			magnitude = (2**abs(score_1)) + (2**abs(score_2))
-			interaction = -numpy.log2(ratio * magnitude)
-		else:
-			temp_score_1 = score_1
-			temp_score_2 = score_2
-			ratio = min([(temp_score_1 / temp_score_2), (temp_score_2 / temp_score_1)])
-			magnitude = (2**score_1) + (2**score_2)
-			interaction = numpy.log2(ratio * magnitude)
-
-		interaction_dictionary[index] = [name, score_1, score_2, ratio, magnitude, interaction]
-
-	return interaction_dictionary
-
-
-# Calculate cumulative importance of each compound across the groups of models tested
-def community_demand(community_dict, member_dict):
-
-	for compound in member_dict.keys():
-		name = member_dict[compound][0]
-		score = member_dict[compound][1]
-		
-		if score < 0:
-			score = -(2**abs(score))
-		else:
-			score = 2**abs(score)
-	
-		try:
-			cumulative_score = community_dict[compound][1] + score
-			if score > 0:
-				consumption = community_dict[compound][2] + score
-				production = community_dict[compound][3]
-			elif score < 0:
-				production = community_dict[compound][3] + score
-				consumption = community_dict[compound][2]
-			community_dict[compound] = [name, cumulative_score, consumption, production]
-		except KeyError:
-			if score > 0:
-				consumption = score
-				production = 0
-			elif score < 0:
-				consumption = 0
-				production = score
-			community_dict[compound] = [name, score, consumption, production]
-
-	return community_dict
-
-
-# Calculates the percentile for the given type of score
-def calc_percentile(output_dictionary, type_index):
-
-	current_list = []
-	for index in output_dictionary.keys():
-		current_list.append(output_dictionary[index][type_index])
-
-	per_90 = [numpy.percentile(current_list, 10), numpy.percentile(current_list, 90)]
-	per_80 = [numpy.percentile(current_list, 20), numpy.percentile(current_list, 80)]
-	per_70 = [numpy.percentile(current_list, 30), numpy.percentile(current_list, 70)]
-	per_60 = [numpy.percentile(current_list, 40), numpy.percentile(current_list, 60)]
-
-	for index in output_dictionary.keys():
-		if output_dictionary[index][type_index] < per_90[0] or output_dictionary[index][type_index] > per_90[1]:
-			output_dictionary[index] = output_dictionary[index] + ['90']
-			continue
-		elif output_dictionary[index][type_index] < per_80[0] or output_dictionary[index][type_index] > per_80[1]:
-			output_dictionary[index] = output_dictionary[index] + ['80']
-			continue
-		elif output_dictionary[index][type_index] < per_70[0] or output_dictionary[index][type_index] > per_70[1]:
-			output_dictionary[index] = output_dictionary[index] + ['70']
-			continue
-		elif output_dictionary[index][type_index] < per_60[0] or output_dictionary[index][type_index] > per_60[1]:
-			output_dictionary[index] = output_dictionary[index] + ['60']
-			continue
-		else:
-			output_dictionary[index] = output_dictionary[index] + ['50']
-
-	return output_dictionary
-
-
-# Function to write data to output file
-def write_output(header, output_dictionary, file_name, type_output):
-
-	with open(file_name, 'w') as outfile:
-		outfile.write(header)
-		
-		if type_output == 'single':
-
-			for index in output_dictionary.keys():
-				
-				name = output_dictionary[index][0]
-				score_1 = output_dictionary[index][1]
-				score_2 = output_dictionary[index][2]
-				ratio = output_dictionary[index][3]
-				magnitude = output_dictionary[index][4]
-				interaction = output_dictionary[index][5]
-				percentile = output_dictionary[index][6]
-
-				entry = '\t'.join([str(index), str(name), str(score_1), str(score_2), str(round(float(ratio), 3)), str(round(float(magnitude), 3)), str(round(float(interaction), 3)), str(round(float(percentile), 3))]) + '\n'
-				outfile.write(entry)
-
-		elif type_output == 'community':
-
-			for index in output_dictionary.keys():
-			
-				name = output_dictionary[index][0]
-				score = output_dictionary[index][1]
-				consumption = output_dictionary[index][2]
-				production = output_dictionary[index][3]
-				percentile = output_dictionary[index][4]
-
-				# Transform scores back to log2
-				if score == 0.0:
-					score = 0.0
-				elif score < 0.0:
-					score = numpy.log2(abs(score)) * -1
-				else:
-					score = numpy.log2((score))
-
-				if consumption == 0.0:
-					consumption = 0.0
-				else:
-					consumption = numpy.log2(consumption)
-
-				if production == 0.0:
-					production = 0.0
-				else:
-					production = numpy.log2(abs(production)) * -1
-
-				entry = '\t'.join([str(index), str(name), str(round(float(score), 3)), str(round(float(consumption), 3)), str(round(float(production), 3)), str(round(float(percentile), 3))]) + '\n'
-				outfile.write(entry)
-
-
-#---------------------------------------------------------------------------------------#
-
-# Worflow
-
-# Retrieve and read in the necessary files
-interactions = open(interactions, 'r')
-interactions_list = read_files(interactions)
-if not os.path.exists('community.files'):	
-	os.makedirs('community.files')
-community_dictionary = {}
-community = []
-current = 0
-for index in interactions_list:
-
-	os.chdir(index[0])
-	scores_1 = read_scores(open('importances.tsv','r'), p_value, normalize)
-	os.chdir(starting_directory)
-	os.chdir(index[1])
-	scores_2 = read_scores(open('importances.tsv','r'), p_value, normalize)
-	os.chdir(starting_directory)
-
-	current += 1
-	print('Calculating metabolic crosstalk: ' + str(current) + ' of ' + str(len(interactions_list)) + '.')
-	interaction = single_interaction(scores_1, scores_2)
-	interaction = calc_percentile(interaction, 5)
-
-	if not str(index[0]) in community:
-		community_dictionary = community_demand(community_dictionary, scores_1)
-		community.append(str(index[0]))
-	if not str(index[1]) in community:
-		community_dictionary = community_demand(community_dictionary, scores_2)
-		community.append(str(index[1]))
-
-	org_name1 = str(index[0]).split('.')[0]
-	org_name2 = str(index[1]).split('.')[0]
-	header = 'compound_code\tcompound_name\t' + org_name1 + '_score\t' + org_name2 + '_score\tratio\tmagnitude\tinteraction_score\tpercentile\n'
-	file_name = str('community.files/' + index[0]) + '.and.' + str(index[1]) + '.interaction.tsv'
-	write_output(header, interaction, file_name, 'single')
-
-# Write cumulative scores to a file
-community_dictionary = calc_percentile(community_dictionary, 1)
-header = 'compound_code\tcompound_name\tcumulative_metabolite_score\tconsumption_score\tproduction_score\tpercentile\n'
-file_name = 'community.files/community_importance.tsv'
-write_output(header, community_dictionary, file_name, 'community')
-print('Done\n')
\ No newline at end of file
+#!/usr/bin/env python
+'''USAGE: python crosstalk.py interaction.files --p n.s. --norm n
+Multi-level inference of substrate competition and cooperation between transcriptome-informed genome-scale models
+Calculates putative community-level and pair-wise metabolic interactions between species from aggregated bigSMALL analysis
+'''
+
+# Initialize all modules, functions, and compound dictionary
+import sys
+import numpy
+import os
+import argparse
+import zipfile
+
+from bigsmall.output import read_archive_table, read_archive_text, InteractionTable, table_index_name
+from bigsmall.community import Community, unordered_pair_interactions, extreme_interactions, percentile_bins, crosstalk_null
+from bigsmall.scoring import benjamini_hochberg
+
+#---------------------------------------------------------------------------------------#
+
+# Define functions
+
+# Function to read in all species listed in the interaction file
+def read_species(files):
+
+	community = []
+	for line in files:
+		species = line.strip()
+		if os.path.exists(species) == False:
+			print('WARNING: ' + species + ' does not exist. Omitting combination.')
+			continue
+		community.append(species)
+
+	return community
+
+
+# Reads importance files, applying p-value and q-value filters, normalizes score to reads, and generates a dictionary for compound names and compound scores
+# Older importance files carry a '<0.05' or 'n.s.' label in place of the p-value and no q-value column
+def read_scores(importance_scores, p_cutoff, norm, q_cutoff=1.0):
+
+	score_dictionary = {}
+	name_dictionary = {}
+
+	for line in importance_scores:
+		
+		line = line.rstrip('\n').split('\t')
+		if line[0] == 'Compound_code': continue
+		
+		compound_code = str(line[0])
+		compound_name = str(line[1])
+		
+		score = float(line[2])
+		if score == 0.0: continue
+		
+		p_value = str(line[3]).lstrip('<')
+		if p_value == 'n.s.': p_value = 1
+		p_value = float(p_value)
+		if p_value > p_cutoff: continue
+		if len(line) > 4 and float(line[4]) > q_cutoff: continue
+
+		score_dictionary[compound_code] = score
+		name_dictionary[compound_code] = compound_name	
+
+	return normalize_scores(score_dictionary, name_dictionary, norm)
+
+
+# Reads an importances table written with --output-format npy, memory-mapped and filtered with array comparisons instead of parsing lines
+def read_score_table(table, p_cutoff, norm, q_cutoff=1.0):
+
+	keep = table['Importance_score'] != 0.0
+	if 'p_value' in table.dtype.names:
+		keep &= table['p_value'] <= p_cutoff
+	if 'q_value' in table.dtype.names:
+		keep &= table['q_value'] <= q_cutoff
+
+	codes = table['Compound_code'][keep].tolist()
+	score_dictionary = dict(zip(codes, table['Importance_score'][keep].tolist()))
+	name_dictionary = dict(zip(codes, table['Metabolite_name'][keep].tolist()))
+
+	return normalize_scores(score_dictionary, name_dictionary, norm)
+
+
+# Normalizes scores to the total absolute score of each model if requested, and pairs each score with its compound name
+def normalize_scores(score_dictionary, name_dictionary, norm):
+
+	if norm == 'y':
+		final_score_dictionary = {}
+		score_sum = sum([abs(x) for x in score_dictionary.values()])
+		for index in score_dictionary.keys():
+			final_score = score_dictionary[index] / score_sum
+			final_score_dictionary[index] = [name_dictionary[index], final_score]
+	else:
+		final_score_dictionary = {}
+		for index in score_dictionary.keys():
+			final_score_dictionary[index] = [name_dictionary[index], score_dictionary[index]]
+	
+	return final_score_dictionary
+
+
+# Reads the importance scores of one species from a bigSMALL output directory or a single run archive
+# Paths are used as given rather than changing directory, so species can be read concurrently from threads
+def load_scores(species, p_cutoff, norm, q_cutoff):
+
+	if zipfile.is_zipfile(species):
+		with zipfile.ZipFile(species, 'r') as archive:
+			members = archive.namelist()
+		if 'importances.npy' in members:
+			return read_score_table(read_archive_table(species, 'importances.npy'), p_cutoff, norm, q_cutoff)
+		return read_scores(read_archive_text(species, 'importances.tsv').splitlines(True), p_cutoff, norm, q_cutoff)
+
+	if os.path.exists(os.path.join(species, 'importances.npy')):
+		return read_score_table(numpy.load(os.path.join(species, 'importances.npy'), mmap_mode='r'), p_cutoff, norm, q_cutoff)
+	with open(os.path.join(species, 'importances.tsv'), 'r') as importance_file:
+		return read_scores(importance_file, p_cutoff, norm, q_cutoff)
+
+
+# Function to write rows of output from columns of values, one list or array per column
+def write_columns(header, columns, file_name):
+
+	with open(file_name, 'w') as outfile:
+		outfile.write(header)
+		for entry in zip(*columns):
+			outfile.write('\t'.join([str(x) for x in entry]) + '\n')
+
+
+# Columns of one pair's output at the given compounds from its rows of the interaction arrays, with their percentiles
+def interaction_columns(matrix, row, column, compounds, ratio, magnitude, interaction, percentile, p_values):
+
+	columns = [[matrix.codes[x] for x in compounds], [matrix.names[x] for x in compounds], matrix.scores[row, compounds].tolist(), matrix.scores[column, compounds].tolist()]
+	columns += [[round(x, 3) for x in values[compounds].tolist()] for values in [ratio, magnitude, interaction]]
+	columns.append([round(x, 3) for x in percentile.tolist()])
+	# Permutation p-value, when one was calculated
+	if p_values is not None:
+		columns.append([round(x, 6) for x in p_values[compounds].tolist()])
+
+	return columns
+
+
+# Compounds written for one pair with their percentiles, which are always taken over every shared compound,
+#	keeping only the strongest interactions when top or threshold is given
+def pair_selection(interaction, levels, edges, top, threshold):
+
+	shared = ~numpy.isnan(interaction)
+	percentile = numpy.zeros(len(interaction))
+	percentile[shared] = percentile_bins(interaction[shared], levels, edges)
+	if top is None and threshold is None:
+		compounds = numpy.flatnonzero(shared)
+	else:
+		compounds = extreme_interactions(interaction, top, threshold)
+
+	return compounds, percentile[compounds]
+
+
+# Header of the file written for one pair
+def pair_header(species_1, species_2, iterations):
+
+	header = 'compound_code\tcompound_name\t' + species_1.split('.')[0] + '_score\t' + species_2.split('.')[0] + '_score\tratio\tmagnitude\tinteraction_score\tpercentile'
+	header += '\tp_value\n' if iterations > 0 else '\n'
+
+	return header
+
+
+# Lines of the long-format table for one pair, led by the names of both species
+def pair_lines(species_1, species_2, columns):
+
+	return ['\t'.join([species_1, species_2] + [str(x) for x in entry]) + '\n' for entry in zip(*columns)]
+
+
+# Writes the cumulative, consumption and production scores of every compound across the community, transformed back to log2
+def write_community(header, matrix, cumulative, consumption, production, levels, edges, file_name):
+
+	percentile = percentile_bins(cumulative, levels, edges)
+	# Totals of 0 stay 0, the logarithm is only taken where a total is nonzero
+	cumulative = numpy.sign(cumulative) * numpy.log2(numpy.abs(cumulative), out=numpy.zeros(len(cumulative)), where=cumulative != 0.0)
+	consumption = numpy.log2(consumption, out=numpy.zeros(len(consumption)), where=consumption != 0.0)
+	production = numpy.where(production == 0.0, 0.0, -numpy.log2(numpy.abs(production), out=numpy.zeros(len(production)), where=production != 0.0))
+
+	columns = [matrix.codes, matrix.names]
+	columns += [[round(x, 3) for x in values.tolist()] for values in [cumulative, consumption, production, percentile]]
+
+	write_columns(header, columns, file_name)
+
+
+#---------------------------------------------------------------------------------------#
+
+# Worflow
+def main(argv=None):
+
+	# Set up arguments
+	parser = argparse.ArgumentParser(description='Calculate metabolic pair-wise and community-level interactions of species from the output of bigSMALL.')
+	parser.add_argument('input_file')
+	parser.add_argument('--p', default='n.s.', help='Minimum p-value for metabolites to be considered in calculations')
+	parser.add_argument('--q', default='n.s.', help='Maximum Benjamini-Hochberg q-value for metabolites to be considered in calculations')
+	parser.add_argument('--norm', default='n', help='Normalize each metabolic model to total transcript recruited to each (y or n)')
+	parser.add_argument('--out', default='community.files', help='Directory for pair-wise and community output files')
+	parser.add_argument('--iters', default='0', help='Number of permutations of each species\' scores across its compounds for interaction p-values (default is 0, no p-values)')
+	parser.add_argument('--seed', default='none', help='Seed for the random number generator used to permute scores (default is unseeded)')
+	parser.add_argument('--workers', default='1', help='Number of processes used to score permutations, results for a given seed do not depend on it')
+	parser.add_argument('--update', default='n', help='Add the listed species to the community saved in the output directory by an earlier run, scoring only pairs with a new species (y or n, default is n)')
+	parser.add_argument('--top', default='none', help='Keep only the this many strongest positive and negative interactions of each pair, written to one indexed interactions.tsv in community order instead of a file per pair (default keeps all)')
+	parser.add_argument('--threshold', default='none', help='Keep only interactions whose absolute score reaches this value, written to one indexed interactions.tsv in community order instead of a file per pair (default keeps all)')
+	parser.add_argument('--symmetric', default='n', help='Write each unordered pair of species once, in the order they are listed, rather than both orientations (y or n, default is n)')
+	parser.add_argument('--percentiles', default='60,70,80,90', help='Comma-separated percentile levels for labelling scores, a score below percentile 100-L or above L is labelled L and scores inside every level 50 (default is 60,70,80,90)')
+	parser.add_argument('--edges', default='none', help='Comma-separated ascending percentile edges from 0 to 100 used in place of --percentiles, a score is labelled with the lower edge of the bin it falls in and scores below the first edge 0 (default is none, use --percentiles)')
+
+	args = parser.parse_args(argv)
+	interactions = args.input_file
+	p_value = args.p
+	q_value = args.q
+	normalize = args.norm
+	out_directory = args.out
+	iterations = int(args.iters)
+	seed = None if args.seed == 'none' else int(args.seed)
+	workers = int(args.workers)
+	levels = [float(x) for x in args.percentiles.split(',')]
+	edges = None if args.edges == 'none' else [float(x) for x in args.edges.split(',')]
+	update = args.update
+	top = None if args.top == 'none' else int(args.top)
+	threshold = None if args.threshold == 'none' else float(args.threshold)
+	symmetric = args.symmetric
+
+	if os.stat(interactions).st_size == 0 : sys.exit('WARNING: Input file empty, quitting')
+	# A cutoff of n.s. keeps every metabolite
+	if p_value == 'n.s.': p_value = 1.0
+	if q_value == 'n.s.': q_value = 1.0
+	p_value = float(p_value)
+	q_value = float(q_value)
+	if p_value < 0.0: sys.exit('WARNING: Invalid p-value cutoff, quitting')
+	if q_value < 0.0: sys.exit('WARNING: Invalid q-value cutoff, quitting')
+	if normalize != 'n' and normalize != 'y': sys.exit('WARNING: Invalid normalization response, quitting')
+	if iterations < 0: sys.exit('WARNING: Invalid iterations value, quitting')
+	if workers < 1: sys.exit('WARNING: Invalid workers value, quitting')
+	if min(levels) <= 50.0 or max(levels) > 100.0: sys.exit('WARNING: Invalid percentile levels, quitting')
+	if edges is not None and (min(edges) < 0.0 or max(edges) > 100.0 or any([x >= y for x, y in zip(edges, edges[1:])])): sys.exit('WARNING: Invalid percentile edges, quitting')
+	if update != 'n' and update != 'y': sys.exit('WARNING: Invalid update response, quitting')
+	if top is not None and top < 1: sys.exit('WARNING: Invalid top value, quitting')
+	if threshold is not None and threshold < 0.0: sys.exit('WARNING: Invalid threshold value, quitting')
+	if symmetric != 'n' and symmetric != 'y': sys.exit('WARNING: Invalid symmetric response, quitting')
+
+	print('\n')
+
+	# Retrieve and read in the necessary files
+	with open(interactions, 'r') as interaction_file:
+		species_list = read_species(interaction_file)
+	if not os.path.exists(out_directory):	
+		os.makedirs(out_directory)
+
+	# Continue the community saved by an earlier run if asked to, as long as its scores were read the same way
+	state_file = os.path.join(out_directory, 'crosstalk_state.npz')
+	parameters = {'p_value': p_value, 'q_value': q_value, 'normalize': normalize, 'iterations': iterations, 'top': top, 'threshold': threshold, 'symmetric': symmetric}
+	community = None
+	if update == 'y' and os.path.exists(state_file):
+		community = Community.load(state_file)
+		if community.parameters != parameters:
+			print('Saved community used different cutoffs, normalization, permutations or output, recalculating every pair.\n')
+			community = None
+	if community is None:
+		community = Community(parameters)
+
+	# Each new species is read once into the species by compound matrix, and only pairs including one are computed
+	new_species = []
+	for species in species_list:
+		if not species in community.matrix.species and not species in new_species:
+			new_species.append(species)
+	new_rows = community.add_species(new_species, [load_scores(species, p_value, normalize, q_value) for species in new_species])
+	old_rows = list(range(len(community.matrix.species) - len(new_rows)))
+	matrix = community.matrix
+	# Interactions are the same either way round, so each unordered pair is scored and permuted once and mirrored
+	pairs = numpy.triu(community.new_pairs(new_rows), 1)
+	total_pairs = int(pairs.sum())
+	if iterations > 0 and total_pairs > 0:
+		significance = crosstalk_null(matrix.scores, iterations, seed, workers, pairs=pairs)
+		for pair_values, tested_values in [(community.pair_means, significance.means), (community.pair_p_values, significance.pair_p_values)]:
+			pair_values[significance.pair_rows, significance.pair_columns] = tested_values
+			pair_values[significance.pair_columns, significance.pair_rows] = tested_values
+
+	# Interactions of every pair go into one long-format table when only the strongest are kept, which 
+	#	carries over the pairs of the saved community's table
+	table = None
+	if top is not None or threshold is not None:
+		table_name = os.path.join(out_directory, 'interactions.tsv')
+		previous = None
+		if len(old_rows) > 0 and os.path.exists(table_name):
+			previous = os.path.join(out_directory, 'interactions.previous.tsv')
+			os.replace(table_name, previous)
+			os.replace(table_index_name(table_name), table_index_name(previous))
+		header = 'species_1\tspecies_2\tcompound_code\tcompound_name\tspecies_1_score\tspecies_2_score\tratio\tmagnitude\tinteraction_score\tpercentile'
+		header += '\tp_value\n' if iterations > 0 else '\n'
+		table = InteractionTable(table_name, header, previous)
+
+	# Rows are visited in community order and new species come last, so pairs are written in that order of species_1 and 
+	#	then species_2, with table lines for the reverse orientation spilled to disk until the row that leads them
+	current = 0
+	for rows, partner_rows in [(old_rows, new_rows), (new_rows, new_rows)]:
+		if len(rows) == 0 or len(partner_rows) == 0: continue
+		for row, partners, ratio, magnitude, interaction in unordered_pair_interactions(matrix.scores, rows=rows, columns=partner_rows):
+			# Species may be given as paths, only their base names are used to name outputs
+			species_1 = os.path.basename(os.path.normpath(matrix.species[row]))
+			if table is not None:
+				table.copy(species_1)
+				table.release(row)
+
+			for position, column in enumerate(partners.tolist()):
+				current += 1
+				print('Calculating metabolic crosstalk: ' + str(current) + ' of ' + str(total_pairs) + '.')
+
+				species_2 = os.path.basename(os.path.normpath(matrix.species[column]))
+				compounds, percentile = pair_selection(interaction[position], levels, edges, top, threshold)
+				pair_p_row = significance.compound_p_values(row, column) if iterations > 0 else None
+				orientations = [(row, column, species_1, species_2)]
+				if symmetric == 'n': orientations.append((column, row, species_2, species_1))
+
+				for first, second, name_1, name_2 in orientations:
+					columns = interaction_columns(matrix, first, second, compounds, ratio[position], magnitude[position], interaction[position], percentile, pair_p_row)
+					if table is None:
+						write_columns(pair_header(name_1, name_2, iterations), columns, os.path.join(out_directory, name_1 + '.and.' + name_2 + '.interaction.tsv'))
+					elif first == row:
+						table.add(name_1, name_2, pair_lines(name_1, name_2, columns))
+					else:
+						table.hold(first, name_1, name_2, pair_lines(name_1, name_2, columns))
+
+	if table is not None:
+		table.close()
+		if previous is not None:
+			os.remove(previous)
+			os.remove(table_index_name(previous))
+
+	# Write the mean interaction of each pair with its significance, q-values are corrected once per unordered pair that shares compounds
+	if iterations > 0:
+		unordered = [(x, y) for x in range(len(matrix.species)) for y in range(x + 1, len(matrix.species))]
+		unordered_p = numpy.array([community.pair_p_values[x] for x in unordered])
+		q_values = numpy.full((len(matrix.species), len(matrix.species)), numpy.nan)
+		tested = ~numpy.isnan(unordered_p)
+		for pair, q_value in zip([x for x, y in zip(unordered, tested) if y], benjamini_hochberg(unordered_p[tested])):
+			q_values[pair] = q_value
+			q_values[pair[::-1]] = q_value
+
+		if symmetric == 'y':
+			pair_lst = unordered
+		else:
+			pair_lst = [(x, y) for x in range(len(matrix.species)) for y in range(len(matrix.species)) if x != y]
+		with open(os.path.join(out_directory, 'pair_significance.tsv'), 'w') as outfile:
+			outfile.write('species_1\tspecies_2\tmean_interaction_score\tp_value\tq_value\n')
+			for pair in pair_lst:
+				species_1 = os.path.basename(os.path.normpath(matrix.species[pair[0]]))
+				species_2 = os.path.basename(os.path.normpath(matrix.species[pair[1]]))
+				outfile.write('\t'.join([species_1, species_2, str(round(float(community.pair_means[pair]), 3)), str(round(float(community.pair_p_values[pair]), 6)), str(round(float(q_values[pair]), 6))]) + '\n')
+
+	# Write cumulative scores to a file, percentiles are taken over the updated totals
+	header = 'compound_code\tcompound_name\tcumulative_metabolite_score\tconsumption_score\tproduction_score\tpercentile\n'
+	file_name = os.path.join(out_directory, 'community_importance.tsv')
+	write_community(header, matrix, community.cumulative, community.consumption, community.production, levels, edges, file_name)
+	community.save(state_file)
+	print('Done\n')
+
+
+if __name__ == '__main__':
+	main()
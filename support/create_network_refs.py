@@ -1,16 +1,113 @@
 #!/usr/bin/env python3
 '''USAGE: python create_network_refs.py kegg_directory
-This script creates pickles for all KEGG datasets needed to create genome-scale metabolic network files'''
+This script creates pickles for all KEGG datasets needed to create genome-scale metabolic network files, 
+along with the pre-parsed reference store that bigsmall.py loads at startup'''
 
 # On Axiom, KEGG files are located in /mnt/EXT/Schloss-data/kegg/kegg
 
 import sys
+import os
 import pickle
+import argparse
+import numpy
+
+#---------------------------------------------------------------------------------------#		
+
+# User defined arguments
+parser = argparse.ArgumentParser(description='Create KEGG reference files for bigSMALL.')
+parser.add_argument('kegg_directory')
+parser.add_argument('--pickles', default='n', help='Only convert existing pkl files in the given directory to the reference store (y or n)')
+args = parser.parse_args()
+
+if args.pickles != 'y' and args.pickles != 'n': sys.exit('WARNING: Invalid pickles response, quitting')
+
+#---------------------------------------------------------------------------------------#		
+
+# Build integer-indexed KO, reaction and compound tables with CSR adjacency arrays from the three dictionaries
+def write_reference_store(ko_dict, reaction_dict, compound_dict, directory):
+
+	# Reactions listed for a KO but missing formulas are kept with no formula rows, so bigsmall.py can still report them
+	ko_ids = sorted(ko_dict.keys())
+	reaction_ids = sorted(set(reaction_dict.keys()) | set(y for x in ko_dict.values() for y in x))
+	formula_compounds = set()
+	for formulas in reaction_dict.values():
+		for formula in formulas:
+			formula_info = formula.split(':')
+			formula_compounds.update(formula_info[0].split('|') + formula_info[2].split('|'))
+	compound_ids = sorted(set(compound_dict.keys()) | formula_compounds)
+
+	reaction_index = dict((reaction, index) for index, reaction in enumerate(reaction_ids))
+	compound_index = dict((compound, index) for index, compound in enumerate(compound_ids))
+
+	# KO to reactions
+	ko_indptr = [0]
+	ko_reactions = []
+	for ko in ko_ids:
+		ko_reactions.extend(reaction_index[x] for x in ko_dict[ko])
+		ko_indptr.append(len(ko_reactions))
+
+	# Reaction to formulas, and formula to input and output compounds
+	reaction_indptr = [0]
+	formula_reversible = []
+	formula_input_indptr = [0]
+	formula_inputs = []
+	formula_output_indptr = [0]
+	formula_outputs = []
+	for reaction in reaction_ids:
+		for formula in reaction_dict.get(reaction, []):
+			formula_info = formula.split(':')
+			formula_inputs.extend(compound_index[x] for x in formula_info[0].split('|'))
+			formula_input_indptr.append(len(formula_inputs))
+			formula_reversible.append(formula_info[1] == 'R')
+			formula_outputs.extend(compound_index[x] for x in formula_info[2].split('|'))
+			formula_output_indptr.append(len(formula_outputs))
+		reaction_indptr.append(len(formula_reversible))
+
+	# Compound names are stored as one UTF-8 byte string with offsets
+	compound_name_indptr = [0]
+	compound_names = []
+	for compound in compound_ids:
+		compound_names.append(compound_dict.get(compound, '').encode('utf-8'))
+		compound_name_indptr.append(compound_name_indptr[-1] + len(compound_names[-1]))
+
+	store = dict(
+		ko_ids=numpy.array([x.encode('utf-8') for x in ko_ids]), 
+		ko_indptr=numpy.array(ko_indptr, dtype=numpy.int32), 
+		ko_reactions=numpy.array(ko_reactions, dtype=numpy.int32), 
+		reaction_ids=numpy.array([x.encode('utf-8') for x in reaction_ids]), 
+		reaction_indptr=numpy.array(reaction_indptr, dtype=numpy.int32), 
+		formula_reversible=numpy.array(formula_reversible, dtype=bool), 
+		formula_input_indptr=numpy.array(formula_input_indptr, dtype=numpy.int32), 
+		formula_inputs=numpy.array(formula_inputs, dtype=numpy.int32), 
+		formula_output_indptr=numpy.array(formula_output_indptr, dtype=numpy.int32), 
+		formula_outputs=numpy.array(formula_outputs, dtype=numpy.int32), 
+		compound_ids=numpy.array([x.encode('utf-8') for x in compound_ids]), 
+		compound_name_indptr=numpy.array(compound_name_indptr, dtype=numpy.int64), 
+		compound_names=numpy.frombuffer(b''.join(compound_names), dtype=numpy.uint8))
+
+	# One uncompressed .npy per array, so every bigsmall.py process on a host can memory-map the same pages
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+	for key in store.keys():
+		numpy.save(os.path.join(directory, key + '.npy'), store[key])
+
+#---------------------------------------------------------------------------------------#		
+
+# Convert previously created pickles without needing the KEGG flat files
+if args.pickles == 'y':
+	pickles = str(args.kegg_directory).rstrip('/')
+	print('\nWriting reference store from existing pkl files...')
+	ko_dict = pickle.load(open(pickles + '/ko_reaction.pkl', 'rb'))
+	reaction_dict_nonrev = pickle.load(open(pickles + '/reaction_mapformula_nonrev.pkl', 'rb'))
+	compound_dict = pickle.load(open(pickles + '/compound.pkl', 'rb'))
+	write_reference_store(ko_dict, reaction_dict_nonrev, compound_dict, pickles + '/kegg_reference')
+	print('Complete.\n')
+	sys.exit()
 
 #---------------------------------------------------------------------------------------#		
 
 # Define where KEGG files are located
-kegg = str(sys.argv[1]).rstrip('/')
+kegg = str(args.kegg_directory).rstrip('/')
 ko_react = kegg + '/genes/ko/ko_reaction.list'
 mapformula = kegg + '/ligand/reaction/reaction_mapformula.lst'
 substrate = kegg + '/ligand/compound/compound'
@@ -202,3 +299,8 @@ with open('compound.pkl','wb') as outfile:
 	
 print('Complete.\n')
 
+# Creates the pre-parsed reference store read by bigsmall.py, using the same reactions as reaction_mapformula_nonrev.pkl
+print('Writing reference store...')
+write_reference_store(ko_dict, reaction_dict_nonrev, compound_dict, 'kegg_reference')
+print('Complete.\n')
+
@@ -0,0 +1,46 @@
+import os
+import pytest
+
+from bigsmall.network import open_expression, transcription_dictionary
+from bigsmall.model import Model, Sample
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples', 'ko_expression.example.tsv')
+
+
+@pytest.fixture(scope='module')
+def expression():
+
+	with open_expression(EXAMPLE) as KO_file:
+		return transcription_dictionary(KO_file)[0]
+
+
+# A sample must follow the shared graph when another sample grows it, rather than index stale scores
+def test_samples_sharing_a_model(expression):
+
+	KOs = sorted(expression)
+	first = dict((ko, expression[ko]) for ko in KOs[:40])
+	model = Model(list(first))
+	sample_1 = Sample(model, first, iterations=0)
+	sample_2 = Sample(model, first, iterations=0)
+
+	sample_1.update(dict((ko, expression[ko]) for ko in KOs[40:240]))
+	scores = sample_2.result.score_dict
+	fresh = Sample(model, first, iterations=0).result.score_dict
+
+	assert sorted(scores) == sorted(fresh) == sorted(model.incidence[0])
+	for compound in fresh:
+		assert scores[compound][1] == pytest.approx(fresh[compound][1])
+
+
+# A KO without reference edges must not replace the shared graph, which would drop other samples' significance
+def test_unmatched_ko_keeps_graph(expression):
+
+	model = Model(list(expression))
+	sample_1 = Sample(model, expression, iterations=1000, seed=1)
+	sample_2 = Sample(model, expression, iterations=1000, seed=1)
+	graph = model.graph
+
+	assert sample_1.update({'K99998': 1.0}) == []
+	assert model.graph is graph
+	assert 'K99998' in model.graph.query_kos
+	assert sample_2.result.final_data is not None